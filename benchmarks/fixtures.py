@@ -0,0 +1,25 @@
+import os
+import numpy as np
+
+from PIL import Image
+
+
+def create_png_fixtures(root, count=64, shape=(96, 128), classes=23, seed=0):
+    """
+    Synthetic CARLA-like dataset: random RGB images and masks holding a class id in the red channel.
+    Returns the images and masks folders.
+    """
+    images_dir = os.path.join(root, "images")
+    masks_dir = os.path.join(root, "masks")
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(masks_dir, exist_ok=True)
+
+    random = np.random.RandomState(seed)
+    for i in range(count):
+        image = random.randint(0, 256, size=(*shape, 3)).astype(np.uint8)
+        mask = np.zeros((*shape, 3), dtype=np.uint8)
+        mask[..., 0] = random.randint(0, classes, size=shape)
+        Image.fromarray(image).save(os.path.join(images_dir, "{:05d}.png".format(i)))
+        Image.fromarray(mask).save(os.path.join(masks_dir, "{:05d}.png".format(i)))
+
+    return images_dir, masks_dir
@@ -0,0 +1,261 @@
+"""
+CPU benchmark suite of the models, the input pipelines and the end to end folder inference.
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --compare base.json results.json
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+def get_environment():
+    import tensorflow as tf
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'timestamp': datetime.datetime.now().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'tensorflow': tf.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'devices': [device.name for device in tf.config.list_logical_devices()]}
+
+
+def get_result(name, value, unit, higher_is_better, **params):
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': higher_is_better, 'params': params}
+
+
+def benchmark_models(variants, batch_sizes, resolutions, filters, repeats):
+    import tensorflow as tf
+
+    from models.inference_model import InferenceModel
+    from utils.model_utils import build_model
+    from utils.values_utils import CLASSES, INPUT_SIZE
+
+    results = []
+    for variant in variants:
+        model = build_model(variant, filters, CLASSES, INPUT_SIZE)
+        forward = tf.function(lambda images: model(images, training=False))
+        inference_model = InferenceModel(model)
+        for height, width in resolutions:
+            for batch_size in batch_sizes:
+                images = tf.random.uniform((batch_size, height, width, 3))
+                for mode, function in (('logits', forward), ('mask', inference_model)):
+                    function(images).numpy()
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        function(images).numpy()
+                    seconds = (time.perf_counter() - start) / repeats
+                    name = "model/{}/{}/{}x{}/b{}".format(variant, mode, height, width, batch_size)
+                    params = {'variant': variant, 'output': mode, 'height': height, 'width': width,
+                              'batch_size': batch_size}
+                    results.append(get_result(name + "/latency", seconds * 1000.0, 'ms', False, **params))
+                    results.append(get_result(name + "/throughput", batch_size / seconds, 'images/s', True, **params))
+                    print(results[-2]['name'], "{:.2f} ms".format(results[-2]['value']))
+
+    return results
+
+
+def get_peak_memory_mb(function, device='CPU:0'):
+    """
+    Peak allocator memory of one call of function on top of what was allocated before it.
+    """
+    import tensorflow as tf
+
+    function()
+    tf.config.experimental.reset_memory_stats(device)
+    current = tf.config.experimental.get_memory_info(device)['current']
+    function()
+    return (tf.config.experimental.get_memory_info(device)['peak'] - current) / 2 ** 20
+
+
+def benchmark_memory(variants, accumulation_steps, batch_size, resolution, filters):
+    import tensorflow as tf
+
+    from utils.model_utils import build_model
+    from utils.values_utils import CLASSES
+
+    height, width = resolution
+    images = tf.random.uniform((batch_size, height, width, 3))
+    masks = tf.random.uniform((batch_size, height, width, 1), maxval=CLASSES, dtype=tf.int32)
+    results = []
+    for variant in variants:
+        model = build_model(variant, filters, CLASSES, (None, height, width, 3))
+        peak_mb = get_peak_memory_mb(lambda: model(images, training=False))
+        results.append(get_result("memory/{}/forward/{}x{}/b{}".format(variant, height, width, batch_size), peak_mb,
+                                  'MB', False, variant=variant, height=height, width=width, batch_size=batch_size))
+        print(results[-1]['name'], "{:.1f} MB".format(peak_mb))
+        for steps in accumulation_steps:
+            model = build_model(variant, filters, CLASSES, (None, height, width, 3))
+            model.accumulation_steps = steps
+            model.build_and_compile((None, height, width, 3))
+            peak_mb = get_peak_memory_mb(lambda: model.train_on_batch(images, masks))
+            results.append(get_result("memory/{}/train/{}x{}/b{}/acc{}".format(variant, height, width, batch_size,
+                                                                             steps),
+                                      peak_mb, 'MB', False, variant=variant, height=height, width=width,
+                                      batch_size=batch_size, accumulation_steps=steps))
+            print(results[-1]['name'], "{:.1f} MB".format(peak_mb))
+
+    return results
+
+
+def iterate_dataset(dataset):
+    start = time.perf_counter()
+    count = 0
+    for batch in dataset:
+        count += len(batch[0]) if isinstance(batch, tuple) else len(batch)
+    return count / (time.perf_counter() - start)
+
+
+def benchmark_data(images_dir, masks_dir, backends, batch_size, cache_dir):
+    from utils.data_utils import get_train_dataset, get_inference_dataset
+
+    results = []
+    for backend in backends:
+        train_dataset, _ = get_train_dataset(images_dir, masks_dir, 0.2, batch_size, data_backend=backend,
+                                             cache_dir=cache_dir)
+        # The first epoch fills the caches, the second one reads from them
+        for epoch in (1, 2):
+            images_per_second = iterate_dataset(train_dataset)
+            results.append(get_result("data/train/{}/epoch{}".format(backend, epoch), images_per_second, 'images/s',
+                                      True, backend=backend, epoch=epoch, batch_size=batch_size))
+            print(results[-1]['name'], "{:.1f} images/s".format(images_per_second))
+        augmented_dataset, _ = get_train_dataset(images_dir, masks_dir, 0.2, batch_size, data_backend=backend,
+                                                 cache_dir=cache_dir, augment=True)
+        iterate_dataset(augmented_dataset)
+        images_per_second = iterate_dataset(augmented_dataset)
+        results.append(get_result("data/train/{}/augment".format(backend), images_per_second, 'images/s', True,
+                                  backend=backend, batch_size=batch_size, augment=True))
+        print(results[-1]['name'], "{:.1f} images/s".format(images_per_second))
+        inference_dataset = get_inference_dataset(images_dir, batch_size, data_backend=backend, cache_dir=cache_dir)
+        images_per_second = iterate_dataset(inference_dataset)
+        results.append(get_result("data/inference/{}".format(backend), images_per_second, 'images/s', True,
+                                  backend=backend, batch_size=batch_size))
+        print(results[-1]['name'], "{:.1f} images/s".format(images_per_second))
+
+    return results
+
+
+def benchmark_end_to_end(images_dir, work_dir, variant, filters, stream):
+    from utils.model_utils import build_model
+    from utils.registry_utils import ModelRegistry
+    from utils.values_utils import CLASSES, INPUT_SIZE, CURR_DATETIME, MODEL_DIR, MODEL_EXTENSION, REGISTRY_PATH
+
+    model_dir = os.path.join(work_dir, MODEL_DIR)
+    os.makedirs(model_dir, exist_ok=True)
+    ckpt_path = os.path.join(MODEL_DIR, CURR_DATETIME + '_' + variant + MODEL_EXTENSION)
+    build_model(variant, filters, CLASSES, INPUT_SIZE).save_weights(os.path.join(work_dir, ckpt_path))
+    ModelRegistry(os.path.join(work_dir, REGISTRY_PATH)).register(ckpt_path, variant, CURR_DATETIME, filters=filters)
+
+    command = [sys.executable, os.path.join(SRC_DIR, "driver.py"), '-t', 'inference', '-v', variant, '-m', 'True',
+               '-f', images_dir, '-e', 'png']
+    if stream:
+        command += ['--stream', 'True']
+    start = time.perf_counter()
+    subprocess.run(command, cwd=work_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+
+    result = get_result("end_to_end/{}/{}".format(variant, 'stream' if stream else 'default'), seconds, 's', False,
+                        variant=variant, stream=stream,
+                        images=len(glob.glob(os.path.join(images_dir, "*.png"))))
+    print(result['name'], "{:.2f} s".format(seconds))
+
+    return [result]
+
+
+def compare_results(base_path, new_path, threshold):
+    with open(base_path) as base_file:
+        base = {result['name']: result for result in json.load(base_file)['results']}
+    with open(new_path) as new_file:
+        new = {result['name']: result for result in json.load(new_file)['results']}
+
+    regressions = []
+    for name in sorted(set(base) & set(new)):
+        base_value, new_value = base[name]['value'], new[name]['value']
+        if base_value == 0:
+            continue
+        change = (new_value - base_value) / base_value
+        if not new[name]['higher_is_better']:
+            change = -change
+        flag = "REGRESSION" if change < -threshold else ""
+        if flag:
+            regressions.append(name)
+        print("{:<60} {:>12.3f} {:>12.3f} {:>+8.1%} {}".format(name, base_value, new_value, change, flag))
+    print("{} regressions over {:.0%}".format(len(regressions), threshold))
+
+    return regressions
+
+
+def parse_resolution(value):
+    height, width = value.lower().split('x')
+    return int(height), int(width)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', type=str, default="benchmark_results.json", help="Result file.")
+    parser.add_argument('-s', '--suites', type=str, nargs='+', default=['model', 'memory', 'data', 'end_to_end'],
+                        help="Suites to run.")
+    parser.add_argument('--variants', type=str, nargs='+', default=['UNetSTD', 'UNetTCED', 'ResUNet'])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--resolutions', type=parse_resolution, nargs='+', default=[(96, 128), (192, 256)])
+    parser.add_argument('--backends', type=str, nargs='+', default=['decode', 'shards', 'mmap'])
+    parser.add_argument('--accumulation_steps', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--filters', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--images', type=int, default=256, help="Number of synthetic images.")
+    parser.add_argument('--gpu', type=bool, help="Allow GPUs, the suite runs on CPU only by default.")
+    parser.add_argument('--compare', type=str, nargs=2, help="Base and new result files to compare.")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative change flagged as a regression.")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_results(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    if not args.gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+
+    from fixtures import create_png_fixtures
+
+    all_results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fixture_images_dir, fixture_masks_dir = create_png_fixtures(os.path.join(tmp_dir, "data"), args.images)
+        if 'model' in args.suites:
+            all_results += benchmark_models(args.variants, args.batch_sizes, args.resolutions, args.filters,
+                                            args.repeats)
+        if 'memory' in args.suites:
+            all_results += benchmark_memory(args.variants, args.accumulation_steps, 32, args.resolutions[0],
+                                            args.filters)
+        if 'data' in args.suites:
+            all_results += benchmark_data(fixture_images_dir, fixture_masks_dir, args.backends, 32,
+                                          os.path.join(tmp_dir, "cache"))
+        if 'end_to_end' in args.suites:
+            for model_variant in args.variants:
+                for stream_output in (False, True):
+                    all_results += benchmark_end_to_end(fixture_images_dir, os.path.join(tmp_dir, "work"),
+                                                        model_variant, args.filters, stream_output)
+
+    with open(args.output, 'w') as output_file:
+        json.dump({'environment': get_environment(), 'results': all_results}, output_file, indent=2)
+    print("Results written to", args.output)
@@ -4,14 +4,26 @@ import argparse
 
 from tensorflow.python.ops.numpy_ops import np_config
 
-from utils.data_utils import get_inference_dataset, get_inference_dataset_numpy
+from utils.data_utils import get_inference_dataset, get_bucketed_inference_datasets
 from utils.file_utils import create_directory
-from utils.image_utils import read_image, resize_image, get_image_from_array
+from utils.image_utils import read_image, resize_image, get_image_from_array, resize_image_to_multiple
+from utils.inference_utils import stream_predictions
 from train import train_new_model, train_from_ckpt
-from utils.model_utils import get_latest_model, generate_prediction
-from utils.display_utils import display_inference, create_mask, create_mask_one
-from utils.values_utils import INF_INPUT_SIZE
-from utils.video_utils import get_all_frames_from_videos
+from models.inference_model import InferenceModel
+from utils.model_utils import get_latest_model, generate_mask, get_registry
+from utils.evaluation_utils import compare_checkpoints
+from utils.display_utils import display_inference
+from utils.values_utils import INF_INPUT_SIZE, DATA_BACKEND, EXPORT_DIR, PRECISION, INFERENCE_BACKEND, TFLITE_PATH, \
+    IMAGES_SRC, MASKS_SRC, VAL_SPLIT, VIDEO_OUTPUT_MODE, REUSE_THRESHOLD, KEYFRAME_INTERVAL, SERVER_PORT, \
+    TILE_OVERLAP, STRATEGY, EPOCHS, BATCH_SIZE, ACCUMULATION_STEPS, \
+    SAMPLING_MODE, SAMPLING_MODES, AUGMENT, CHECKPOINT_SELECTIONS
+from utils.quantize_utils import export_int8_tflite, compare_quantized_model, TFLiteInferenceModel
+from utils.precision_utils import set_precision
+from utils.trace_utils import trace_model
+from utils.serving_utils import serve
+from utils.tiling_utils import tiled_predict, get_logits_function
+from utils.video_utils import segment_video
+from utils.temporal_utils import TemporalReuse
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -25,42 +37,139 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--save', type=bool, help="Save the prediction.")
     parser.add_argument('-e', '--extension', type=str, help="Image Extension.")
     parser.add_argument('-o', '--video', type=bool, help="Is Video.")
+    parser.add_argument('--threads', type=int, help="Cap on host threads used by the input pipeline.")
+    parser.add_argument('--stream', type=bool, help="Stream batched predictions to disk.")
+    parser.add_argument('--export_dir', type=str, default=EXPORT_DIR, help="Export directory of the SavedModel.")
+    parser.add_argument('--trace', type=bool, help="Trace block output shapes and latencies.")
+    parser.add_argument('--precision', type=str, default=PRECISION, help="float32, mixed_float16 or mixed_bfloat16.")
+    parser.add_argument('--inference_backend', type=str, default=INFERENCE_BACKEND, help="keras or tflite.")
+    parser.add_argument('--tflite_path', type=str, default=TFLITE_PATH, help="Path of the INT8 TFLite model.")
+    parser.add_argument('--which', type=str, default='latest', choices=CHECKPOINT_SELECTIONS,
+                        help="latest or best checkpoint.")
+    parser.add_argument('--video_mode', type=str, default=VIDEO_OUTPUT_MODE, help="mask or overlay video output.")
+    parser.add_argument('--reuse_threshold', type=float, default=REUSE_THRESHOLD, help="Video frame change threshold.")
+    parser.add_argument('--keyframe_interval', type=int, default=KEYFRAME_INTERVAL, help="Full inference interval.")
+    parser.add_argument('--measure_drift', type=bool, help="Measure the drift of reused video masks.")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="Port of the inference server.")
+    parser.add_argument('--tiled', type=bool, help="Tiled inference at the full image resolution.")
+    parser.add_argument('--overlap', type=int, default=TILE_OVERLAP, help="Overlap of the tiles in pixels.")
+    parser.add_argument('--native_resolution', type=bool, help="Inference at the native image resolution.")
+    parser.add_argument('--data_backend', type=str, default=DATA_BACKEND, help="Input pipeline backend.")
+    parser.add_argument('--profile_steps', type=int, nargs=2, help="Start and stop step of a TF profiler trace.")
+    parser.add_argument('--masks_folder', type=str, help="Source folder of the training masks.")
+    parser.add_argument('--strategy', type=str, default=STRATEGY, help="default, mirrored or multi_worker.")
+    parser.add_argument('--epochs', type=int, default=EPOCHS, help="Number of training epochs.")
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help="Training batch size per replica.")
+    parser.add_argument('--accumulation_steps', type=int, default=ACCUMULATION_STEPS,
+                        help="Micro-batches the training batch is split into.")
+    parser.add_argument('--sampling', type=str, default=SAMPLING_MODE, choices=SAMPLING_MODES,
+                        help="balanced or hard example sampling.")
+    parser.add_argument('--augment', type=bool, default=AUGMENT, help="Augment the training batches.")
+    parser.add_argument('--checkpoints', type=str, nargs='+', help="Checkpoints to evaluate, by name or path.")
+    parser.add_argument('--parallel', type=bool, help="Score the evaluated checkpoints concurrently.")
 
     args = parser.parse_args()
 
     if args.task == "training":
+        images_folder = args.source_folder if args.source_folder is not None else IMAGES_SRC
+        masks_folder = args.masks_folder if args.masks_folder is not None else MASKS_SRC
         if args.new:
-            train_new_model(model_type=args.variation)
+            train_new_model(args.variation, images_folder, masks_folder, num_threads=args.threads,
+                            data_backend=args.data_backend, precision=args.precision,
+                            profile_steps=args.profile_steps, strategy=args.strategy, epochs=args.epochs,
+                            batch_size=args.batch_size, accumulation_steps=args.accumulation_steps,
+                            sampling=args.sampling, augment=args.augment)
         else:
-            train_from_ckpt(model_type=args.variation)
+            train_from_ckpt(args.variation, images_folder, masks_folder, num_threads=args.threads,
+                            data_backend=args.data_backend, precision=args.precision,
+                            profile_steps=args.profile_steps, strategy=args.strategy, epochs=args.epochs,
+                            batch_size=args.batch_size, accumulation_steps=args.accumulation_steps,
+                            sampling=args.sampling, augment=args.augment)
+    elif args.task == "evaluation":
+        set_precision(args.precision)
+        registry = get_registry()
+        entries = [registry.get(x) for x in args.checkpoints] if args.checkpoints else registry.resolve_all(args.which)
+        compare_checkpoints(entries, args.source_folder if args.source_folder is not None else IMAGES_SRC,
+                            args.masks_folder if args.masks_folder is not None else MASKS_SRC,
+                            num_threads=args.threads, parallel=args.parallel)
+    elif args.task == "export":
+        set_precision(args.precision)
+        InferenceModel(get_latest_model(args.variation, args.which)).export(args.export_dir)
+    elif args.task == "quantization":
+        model = get_latest_model(args.variation, args.which)
+        calibration_folder = args.source_folder if args.source_folder is not None else IMAGES_SRC
+        export_int8_tflite(model, calibration_folder, args.tflite_path)
+        # Scored on the validation split of the calibration data
+        compare_quantized_model(model, TFLiteInferenceModel(args.tflite_path, args.threads), calibration_folder,
+                                args.masks_folder if args.masks_folder is not None else MASKS_SRC, VAL_SPLIT)
+    elif args.task == "serving":
+        set_precision(args.precision)
+        if args.inference_backend == 'tflite':
+            serve(TFLiteInferenceModel(args.tflite_path, args.threads), port=args.port)
+        else:
+            serve(InferenceModel(get_latest_model(args.variation, args.which)), port=args.port)
     elif args.task == "inference":
-        model = get_latest_model()
+        set_precision(args.precision)
+        if args.inference_backend == 'tflite':
+            model = None
+            inference_model = TFLiteInferenceModel(args.tflite_path, args.threads)
+        else:
+            model = get_latest_model(args.variation, args.which)
+            inference_model = InferenceModel(model)
         if args.video:
             assert args.file_url is not None
-            frames = get_all_frames_from_videos(args.file_url)
-            print("frames", frames)
-            inference_dataset = get_inference_dataset_numpy(args.source_folder, batch_size=32)
-            predicted_tensors = create_mask(generate_prediction(model, inference_dataset))
-            print("predicted_tensors", predicted_tensors)
+            destination_path = create_directory(os.path.dirname(args.file_url) or ".")
+            video_name = os.path.splitext(os.path.basename(args.file_url))[0]
+            if args.reuse_threshold is not None:
+                inference_model = TemporalReuse(inference_model, args.reuse_threshold, args.keyframe_interval,
+                                                bool(args.measure_drift))
+            segment_video(inference_model, args.file_url, os.path.join(destination_path, video_name + "_output.mp4"),
+                          mode=args.video_mode)
 
         elif args.multiple:
             assert args.source_folder is not None
             assert args.extension is not None
             destination_path = create_directory(args.source_folder)
             names = [os.path.basename(x) for x in glob.glob(os.path.join(args.source_folder, "*."+args.extension))]
-            inference_dataset = get_inference_dataset(args.source_folder, batch_size=32)
-            predicted_tensors = create_mask(generate_prediction(model, inference_dataset))
-            c = 0
-            for predicted_tensor in predicted_tensors:
-                prediction_image = get_image_from_array(predicted_tensor)
-                prediction_image.save(os.path.join(destination_path, str(names[c]) + "_output."+args.extension))
-                c += 1
+            if args.tiled:
+                assert model is not None
+                images = (read_image(os.path.join(args.source_folder, name)).numpy() for name in names)
+                for name, mask in zip(names, tiled_predict(get_logits_function(model), images, overlap=args.overlap)):
+                    get_image_from_array(mask).save(os.path.join(destination_path, name + "_output."+args.extension))
+            elif args.native_resolution:
+                for images_list, inference_dataset in get_bucketed_inference_datasets(args.source_folder, batch_size=32,
+                                                                                      num_threads=args.threads):
+                    output_paths = [os.path.join(destination_path, os.path.basename(x) + "_output."+args.extension)
+                                    for x in images_list]
+                    stream_predictions(inference_model, inference_dataset, output_paths)
+            else:
+                inference_dataset = get_inference_dataset(args.source_folder, batch_size=32, num_threads=args.threads,
+                                                          data_backend=args.data_backend)
+                if args.trace and model is not None:
+                    trace_model(model, next(iter(inference_dataset)))
+                if args.stream:
+                    output_paths = [os.path.join(destination_path, str(name) + "_output."+args.extension)
+                                    for name in names]
+                    stream_predictions(inference_model, inference_dataset, output_paths)
+                else:
+                    predicted_tensors = generate_mask(inference_model, inference_dataset)
+                    c = 0
+                    for predicted_tensor in predicted_tensors:
+                        prediction_image = get_image_from_array(predicted_tensor)
+                        prediction_image.save(os.path.join(destination_path,
+                                                           str(names[c]) + "_output."+args.extension))
+                        c += 1
         else:
             assert args.file_url is not None
             assert args.extension is not None
             np_config.enable_numpy_behavior()
-            input_tensor = resize_image(read_image(args.file_url)).reshape(INF_INPUT_SIZE)
-            predicted_tensor = create_mask_one(generate_prediction(model, input_tensor))
+            if args.native_resolution:
+                input_tensor = resize_image_to_multiple(read_image(args.file_url))[None]
+            else:
+                input_tensor = resize_image(read_image(args.file_url)).reshape(INF_INPUT_SIZE)
+            if args.trace and model is not None:
+                trace_model(model, input_tensor)
+            predicted_tensor = generate_mask(inference_model, input_tensor)[0]
             prediction_image = get_image_from_array(predicted_tensor)
             input_image = get_image_from_array(input_tensor[0])
             if args.save:
@@ -0,0 +1,115 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from utils.values_utils import IMAGES_SRC, MASKS_SRC, LOGGER_DIR, BATCH_SIZE
+
+DRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "driver.py")
+
+
+def get_free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+
+    return ports
+
+
+def get_worker_cores(task_id, cores_per_worker):
+    cores = sorted(os.sched_getaffinity(0))
+    start = (task_id * cores_per_worker) % len(cores)
+    return set(cores[start:start + cores_per_worker]) or set(cores)
+
+
+def launch_workers(num_workers, driver_args, run_dir, cores_per_worker=None):
+    """
+    Runs driver.py training as num_workers local processes of a MultiWorkerMirroredStrategy cluster, worker 0 being
+    the chief, each optionally pinned to its own cores. Returns the wall time of the job.
+    """
+    os.makedirs(os.path.join(run_dir, os.path.dirname(LOGGER_DIR)), exist_ok=True)
+    workers = ['localhost:{}'.format(port) for port in get_free_ports(num_workers)]
+
+    start = time.perf_counter()
+    processes = []
+    for task_id in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': {'worker': workers},
+                                                     'task': {'type': 'worker', 'index': task_id}}))
+        preexec_fn = None
+        if cores_per_worker:
+            cores = get_worker_cores(task_id, cores_per_worker)
+            preexec_fn = lambda cores=cores: os.sched_setaffinity(0, cores)
+        processes.append(subprocess.Popen([sys.executable, DRIVER_PATH, '-t', 'training', '--strategy', 'multi_worker']
+                                          + driver_args, cwd=run_dir, env=env, preexec_fn=preexec_fn,
+                                          stdout=None if task_id == 0 else subprocess.DEVNULL,
+                                          stderr=None if task_id == 0 else subprocess.DEVNULL))
+    return_codes = [process.wait() for process in processes]
+    if any(return_codes):
+        raise RuntimeError("Workers exited with {}".format(return_codes))
+
+    return time.perf_counter() - start
+
+
+def read_chief_step_rate(run_dir):
+    # Global steps per second of the chief, every step consumes one global batch across the workers; the first epoch is
+    # skipped as it includes tracing and the input cache fill
+    log_path = max(glob.glob(os.path.join(run_dir, os.path.dirname(LOGGER_DIR), "*")), key=os.path.getmtime)
+    with open(log_path) as log_file:
+        rows = list(csv.DictReader(log_file))
+    rows = rows[1:] or rows
+
+    return sum(float(row['steps_per_sec']) for row in rows) / len(rows)
+
+
+def get_scaling_report(worker_counts, driver_args, runs_dir, cores_per_worker=None, batch_size=BATCH_SIZE):
+    """
+    Throughput of every worker count as global steps per second times the global batch, batch_size on each worker.
+    """
+    report = []
+    for num_workers in worker_counts:
+        run_dir = os.path.join(runs_dir, "{}_workers".format(num_workers))
+        wall_time = launch_workers(num_workers, driver_args + ['--batch_size', str(batch_size)], run_dir,
+                                   cores_per_worker)
+        images_per_sec = read_chief_step_rate(run_dir) * batch_size * num_workers
+        report.append({'workers': num_workers, 'wall_time_s': wall_time, 'images_per_sec': images_per_sec})
+
+    base = report[0]
+    for entry in report:
+        entry['speedup'] = entry['images_per_sec'] / base['images_per_sec']
+        entry['efficiency'] = entry['speedup'] * base['workers'] / entry['workers']
+        print("{:>3} workers {:>10.1f} images/s {:>6.2f}x speedup {:>6.1%} efficiency {:>8.1f} s".format(
+            entry['workers'], entry['images_per_sec'], entry['speedup'], entry['efficiency'], entry['wall_time_s']))
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker counts to run.")
+    parser.add_argument('-v', '--variation', type=str, default='UNetSTD', help="Variation.")
+    parser.add_argument('-f', '--source_folder', type=str, default=IMAGES_SRC, help="Source folder of images.")
+    parser.add_argument('--masks_folder', type=str, default=MASKS_SRC, help="Source folder of the masks.")
+    parser.add_argument('--epochs', type=int, default=3, help="Training epochs of every run.")
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help="Batch size of every worker.")
+    parser.add_argument('--cores_per_worker', type=int, help="Pin every worker to its own cores.")
+    parser.add_argument('--runs_dir', type=str, default="./scaling_runs/", help="Working directory of the runs.")
+    parser.add_argument('--report_path', type=str, default="./scaling_runs/report.json", help="Report file.")
+
+    args = parser.parse_args()
+
+    worker_args = ['-v', args.variation, '-n', 'True', '-f', os.path.abspath(args.source_folder),
+                   '--masks_folder', os.path.abspath(args.masks_folder), '--epochs', str(args.epochs)]
+    scaling_report = get_scaling_report(args.workers, worker_args, args.runs_dir, args.cores_per_worker,
+                                        args.batch_size)
+
+    os.makedirs(os.path.dirname(args.report_path) or '.', exist_ok=True)
+    with open(args.report_path, 'w') as report_file:
+        json.dump(scaling_report, report_file, indent=2)
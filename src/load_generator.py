@@ -0,0 +1,47 @@
+import argparse
+import time
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+from utils.values_utils import SERVER_HOST, SERVER_PORT
+
+
+def send_request(url, body):
+    start = time.perf_counter()
+    with urlopen(Request(url, data=body, headers={'Content-Type': 'image/png'})) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_load(url, body, num_requests, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda _: send_request(url, body), range(num_requests)))
+    seconds = time.perf_counter() - start
+
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {'requests': num_requests,
+            'concurrency': concurrency,
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'throughput': num_requests / seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--file_url', type=str, required=True, help="Image sent with every request.")
+    parser.add_argument('-n', '--requests', type=int, default=500, help="Number of requests.")
+    parser.add_argument('-c', '--concurrency', type=int, default=32, help="Concurrent clients.")
+    parser.add_argument('--url', type=str, default="http://{}:{}/segment".format(SERVER_HOST, SERVER_PORT),
+                        help="Segmentation endpoint.")
+
+    args = parser.parse_args()
+
+    with open(args.file_url, 'rb') as image_file:
+        image_body = image_file.read()
+    send_request(args.url, image_body)
+    report = run_load(args.url, image_body, args.requests, args.concurrency)
+    print("{requests} requests, {concurrency} clients: p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms, "
+          "{throughput:.1f} images/s".format(**report))
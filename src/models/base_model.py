@@ -0,0 +1,67 @@
+import tensorflow as tf
+
+from utils.metrics_utils import MeanIoU, FrequencyWeightedIoU
+from utils.precision_utils import get_optimizer
+from utils.values_utils import ACCUMULATION_STEPS
+
+
+class SegmentationModel(tf.keras.Model):
+    """
+    Shared base of UNetSTD, UNetTCED and ResUNet: compilation and the training step.
+
+    With accumulation_steps > 1 every batch is split into that many micro-batches whose gradients are summed before
+    a single optimizer step, so the activations held in memory are those of one micro-batch while the update is the
+    one of the whole batch.
+    """
+
+    def __init__(self, filters, classes, accumulation_steps=ACCUMULATION_STEPS):
+        super(SegmentationModel, self).__init__()
+        self.filters = filters
+        self.classes = classes
+        self.accumulation_steps = accumulation_steps
+
+    def build_and_compile(self, input_size):
+        self.build(input_size)
+        mean_iou = MeanIoU(self.classes)
+        self.compile(optimizer=get_optimizer(),
+                     loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                     metrics=['accuracy', mean_iou, FrequencyWeightedIoU(mean_iou)])
+
+    def train_step(self, data):
+        if self.accumulation_steps <= 1:
+            return super(SegmentationModel, self).train_step(data)
+
+        images, masks = data
+        batch_size = tf.shape(images)[0]
+        micro_batch_size = -(-batch_size // self.accumulation_steps)
+        loss_scaling = isinstance(self.optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+
+        def accumulate(start, gradients):
+            # Starting the forward pass only once the previous gradients are summed keeps one micro-batch of
+            # activations alive at a time
+            with tf.control_dependencies(gradients):
+                micro_images = tf.identity(images[start:start + micro_batch_size])
+            micro_masks = masks[start:start + micro_batch_size]
+            with tf.GradientTape() as tape:
+                predictions = self(micro_images, training=True)
+                # Weighting the mean loss of each micro-batch by its share of the batch sums to the batch mean loss
+                loss = self.compiled_loss(micro_masks, predictions, regularization_losses=self.losses) * \
+                    tf.cast(tf.shape(micro_images)[0] / batch_size, tf.float32)
+                if loss_scaling:
+                    loss = self.optimizer.get_scaled_loss(loss)
+            micro_gradients = tape.gradient(loss, self.trainable_variables)
+            self.compiled_metrics.update_state(micro_masks, predictions)
+
+            return start + micro_batch_size, [gradient + micro_gradient
+                                              for gradient, micro_gradient in zip(gradients, micro_gradients)]
+
+        _, gradients = tf.while_loop(lambda start, _: start < batch_size, accumulate,
+                                     [tf.constant(0), [tf.zeros_like(variable) for variable in self.trainable_variables]],
+                                     parallel_iterations=1)
+
+        if loss_scaling:
+            # The loss scale optimizer skips the step and lowers the scale when any micro-batch overflowed
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+
+        return {metric.name: metric.result() for metric in self.metrics}
@@ -0,0 +1,25 @@
+import tensorflow as tf
+
+
+class InferenceModel(tf.Module):
+    """
+    Inference wrapper around UNetSTD, UNetTCED and ResUNet.
+    The forward pass, the argmax over the classes and the uint8 cast are compiled into a single graph with a fixed
+    input signature, so only the (batch, height, width, 1) uint8 mask leaves the device instead of the logits.
+    The signature leaves the batch, height and width dimensions open, so any height and width divisible by
+    SIZE_MULTIPLE run through the same graph without retracing.
+    """
+
+    def __init__(self, model):
+        super(InferenceModel, self).__init__()
+        self.model = model
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.float32)])
+    def __call__(self, images):
+        logits = self.model(images, training=False)
+        mask = tf.cast(tf.argmax(logits, axis=-1), tf.uint8)
+
+        return mask[..., tf.newaxis]
+
+    def export(self, export_dir):
+        tf.saved_model.save(self, export_dir, signatures={'serving_default': self.__call__})
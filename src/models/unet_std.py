@@ -1,7 +1,10 @@
 import tensorflow as tf
 
+from models.base_model import SegmentationModel
+from utils.values_utils import ACCUMULATION_STEPS
 
-class UNetSTD(tf.keras.Model):
+
+class UNetSTD(SegmentationModel):
     """
     Skip Connection to add encoder output to corresponding decoder input at same depth level.
     Similar to Copy and Crop from the original U-Net architecture.
@@ -29,10 +32,8 @@ class UNetSTD(tf.keras.Model):
 
     """
 
-    def __init__(self, filters, classes, input_size):
-        super(UNetSTD, self).__init__()
-        self.filters = filters
-        self.classes = classes
+    def __init__(self, filters, classes, input_size, accumulation_steps=ACCUMULATION_STEPS):
+        super(UNetSTD, self).__init__(filters, classes, accumulation_steps)
         self.encoder_block_1_conv1, \
             self.encoder_block_1_conv2, \
             self.encoder_block_1_maxpool, \
@@ -75,10 +76,7 @@ class UNetSTD(tf.keras.Model):
         self.output_block_0_conv, \
             self.output_block_0_output, = self.output_block(classes=classes)
 
-        self.build(input_size)
-        self.compile(optimizer='adam',
-                     loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-                     metrics=['accuracy'])
+        self.build_and_compile(input_size)
 
     """
     Encoder block function
@@ -180,10 +178,12 @@ class UNetSTD(tf.keras.Model):
             padding="same"
         )
 
+        # Logits stay in float32 under a mixed precision policy for a stable softmax cross-entropy
         output = tf.keras.layers.Conv2D(
             filters=classes,
             kernel_size=1,
-            padding='same'
+            padding='same',
+            dtype='float32'
         )
 
         return conv, output
@@ -192,27 +192,27 @@ class UNetSTD(tf.keras.Model):
 
         x = self.encoder_block_1_conv1(inputs)
         x = self.encoder_block_1_conv2(x)
-        skip_connection_input_1 = tf.identity(x)
+        skip_connection_input_1 = x
         x = self.encoder_block_1_maxpool(x)
         if training:
             x = self.encoder_block_1_dropout1(x)
 
         x = self.encoder_block_2_conv1(x)
         x = self.encoder_block_2_conv2(x)
-        skip_connection_input_2 = tf.identity(x)
+        skip_connection_input_2 = x
         x = self.encoder_block_2_maxpool(x)
         if training:
             x = self.encoder_block_2_dropout2(x)
 
         x = self.encoder_block_3_conv1(x)
         x = self.encoder_block_3_conv2(x)
-        skip_connection_input_3 = tf.identity(x)
+        skip_connection_input_3 = x
         x = self.encoder_block_3_maxpool(x)
         if training:
             x = self.encoder_block_3_dropout3(x)
         x = self.encoder_block_4_conv1(x)
         x = self.encoder_block_4_conv2(x)
-        skip_connection_input_4 = tf.identity(x)
+        skip_connection_input_4 = x
         x = self.encoder_block_4_maxpool(x)
         if training:
             x = self.encoder_block_4_dropout4(x)
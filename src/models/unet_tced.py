@@ -1,7 +1,10 @@
 import tensorflow as tf
 
+from models.base_model import SegmentationModel
+from utils.values_utils import ACCUMULATION_STEPS
 
-class UNetTCED(tf.keras.Model):
+
+class UNetTCED(SegmentationModel):
     """
     Skip Connection to add encoder output to corresponding decoder input at same depth level.
     Similar to Copy and Crop from the original U-Net architecture.
@@ -17,43 +20,44 @@ class UNetTCED(tf.keras.Model):
         return primary
 
     @staticmethod
-    def skip_connections(primary, encoder_blocks_output):
-        primary_shape = primary.shape
-        for layer in encoder_blocks_output:
-            layer_shape = layer.shape
-            if primary_shape[1] == layer_shape[1] and primary_shape[2] == layer_shape[2]:
-                primary = tf.keras.layers.concatenate(
-                    inputs=[primary, layer],
-                    axis=3
-                )
+    def skip_connection_plan(encoder_depths=(0, 1, 2, 3), decoder_depths=(3, 2, 1, 0)):
+        """
+        Static plan of the encoder outputs concatenated at every decoder depth.
+        Each encoder output is brought to the resolution of a decoder depth by chaining 2x max pooling or 2x
+        upsampling from the closest resolution already computed, starting from the encoder output itself and its
+        max pooled version computed by the encoder block, so every resampled tensor is computed once per call and
+        reused by the following decoder depths.
+        Entries are (operations, inputs) where operations are (operation, source, target) and tensors are keyed by
+        (encoder depth, resolution depth).
+        """
+        available = {(depth, depth) for depth in encoder_depths} | {(depth, depth + 1) for depth in encoder_depths}
+        plan = []
+        for decoder_depth in decoder_depths:
+            operations = []
+            for encoder_depth in encoder_depths:
+                path = []
+                target = (encoder_depth, decoder_depth)
+                while target not in available:
+                    step = -1 if encoder_depth < target[1] else 1
+                    source = (encoder_depth, target[1] + step)
+                    path.append(('maxpool' if step == -1 else 'upsampling', source, target))
+                    target = source
+                for operation in reversed(path):
+                    operations.append(operation)
+                    available.add(operation[2])
+            plan.append((tuple(operations), tuple((depth, decoder_depth) for depth in encoder_depths)))
+
+        return tuple(plan)
+
+    def skip_connections(self, primary, decoder_step, resampled):
+        operations, inputs = self.skip_plan[decoder_step]
+        for operation, source, target in operations:
+            if operation == 'maxpool':
+                resampled[target] = self.skip_maxpool(resampled[source])
             else:
-                len_factor = layer_shape[1] / primary_shape[1]
-                wid_factor = layer_shape[2] / primary_shape[2]
-
-                if len_factor > 1 and wid_factor > 1:
-                    len_factor = int(len_factor)
-                    wid_factor = int(wid_factor)
-                    transformed_layer = tf.keras.layers.MaxPool2D(
-                        pool_size=(len_factor, wid_factor)
-                    )(layer)
-                elif 1 > len_factor > 0 and 1 > wid_factor > 0:
-
-                    len_factor = int(1 / len_factor)
-                    wid_factor = int(1 / wid_factor)
-                    transformed_layer = tf.keras.layers.UpSampling2D(
-                        size=(len_factor, wid_factor)
-                    )(layer)
-                else:
-                    assert False
-
-                assert (primary_shape[1:3] == transformed_layer.shape[1:3])
-
-                primary = tf.keras.layers.concatenate(
-                    inputs=[primary, transformed_layer],
-                    axis=3
-                )
+                resampled[target] = self.skip_upsampling(resampled[source])
 
-        return primary
+        return tf.concat([primary] + [resampled[key] for key in inputs], axis=3)
 
     """
     U-Net inspired architecture, with 4 encoder blocks, 1 bottle neck layer and 4 decoder block
@@ -68,10 +72,8 @@ class UNetTCED(tf.keras.Model):
 
     """
 
-    def __init__(self, filters, classes, input_size):
-        super(UNetTCED, self).__init__()
-        self.filters = filters
-        self.classes = classes
+    def __init__(self, filters, classes, input_size, accumulation_steps=ACCUMULATION_STEPS):
+        super(UNetTCED, self).__init__(filters, classes, accumulation_steps)
         self.encoder_block_1_conv1, \
             self.encoder_block_1_conv2, \
             self.encoder_block_1_maxpool, \
@@ -114,10 +116,11 @@ class UNetTCED(tf.keras.Model):
         self.output_block_0_conv, \
             self.output_block_0_output, = self.output_block(classes=classes)
 
-        self.build(input_size)
-        self.compile(optimizer='adam',
-                     loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-                     metrics=['accuracy'])
+        self.skip_plan = UNetTCED.skip_connection_plan()
+        self.skip_maxpool = tf.keras.layers.MaxPool2D(pool_size=2)
+        self.skip_upsampling = tf.keras.layers.UpSampling2D(size=2)
+
+        self.build_and_compile(input_size)
 
     """
     Encoder block function
@@ -219,158 +222,91 @@ class UNetTCED(tf.keras.Model):
             padding="same"
         )
 
+        # Logits stay in float32 under a mixed precision policy for a stable softmax cross-entropy
         output = tf.keras.layers.Conv2D(
             filters=classes,
             kernel_size=1,
-            padding='same'
+            padding='same',
+            dtype='float32'
         )
 
         return conv, output
 
     def call(self, inputs, training=False):
-        tpt = False
-        tpt2 = False
-        tpt3 = False
-        if tpt:
-            print("************************", inputs.shape)
         x = self.encoder_block_1_conv1(inputs)
-        if tpt:
-            print("encoder_block_1_conv1 shape", x.shape)
         x = self.encoder_block_1_conv2(x)
-        if tpt:
-            print("encoder_block_1_conv2 shape", x.shape)
-        skip_connection_input_1 = tf.identity(x)
-        if tpt2:
-            print("E skip_connection_input _1 shape", x.shape)
+        skip_connection_input_1 = x
         x = self.encoder_block_1_maxpool(x)
-        if tpt:
-            print("encoder_block_1_maxpool shape", x.shape)
+        pooled_skip_connection_input_1 = x
         if training:
             x = self.encoder_block_1_dropout1(x)
 
         x = self.encoder_block_2_conv1(x)
-        if tpt:
-            print("encoder_block_2_conv1 shape", x.shape)
         x = self.encoder_block_2_conv2(x)
-        if tpt:
-            print("encoder_block_2_conv2 shape", x.shape)
-        skip_connection_input_2 = tf.identity(x)
-        if tpt2:
-            print("E skip_connection_input _2 shape", x.shape)
+        skip_connection_input_2 = x
         x = self.encoder_block_2_maxpool(x)
-        if tpt:
-            print("encoder_block_2_maxpool shape", x.shape)
+        pooled_skip_connection_input_2 = x
         if training:
             x = self.encoder_block_2_dropout2(x)
 
         x = self.encoder_block_3_conv1(x)
-        if tpt:
-            print("encoder_block_3_conv1 shape", x.shape)
         x = self.encoder_block_3_conv2(x)
-        if tpt:
-            print("encoder_block_3_conv2 shape", x.shape)
-        skip_connection_input_3 = tf.identity(x)
-        if tpt2:
-            print("E skip_connection_input _3 shape", x.shape)
+        skip_connection_input_3 = x
         x = self.encoder_block_3_maxpool(x)
-        if tpt:
-            print("encoder_block_3_maxpool shape", x.shape)
+        pooled_skip_connection_input_3 = x
         if training:
             x = self.encoder_block_3_dropout3(x)
         x = self.encoder_block_4_conv1(x)
-        if tpt:
-            print("encoder_block_4_conv1 shape", x.shape)
         x = self.encoder_block_4_conv2(x)
-        if tpt:
-            print("encoder_block_4_conv2 shape", x.shape)
-        skip_connection_input_4 = tf.identity(x)
-        if tpt2:
-            print("E skip_connection_input _4 shape", x.shape)
+        skip_connection_input_4 = x
         x = self.encoder_block_4_maxpool(x)
-        if tpt:
-            print("encoder_block_4_maxpool shape", x.shape)
+        pooled_skip_connection_input_4 = x
         if training:
             x = self.encoder_block_4_dropout4(x)
 
         x = self.bottle_neck_block_conv1(x)
-        if tpt:
-            print("bottle_neck_block_conv1 shape", x.shape)
         x = self.bottle_neck_block_conv2(x)
-        if tpt:
-            print("bottle_neck_block_conv2 shape", x.shape)
 
-        encoder_blocks_output = [skip_connection_input_1, skip_connection_input_2, skip_connection_input_3,
-                                 skip_connection_input_4]
+        resampled = {
+            (0, 0): skip_connection_input_1, (0, 1): pooled_skip_connection_input_1,
+            (1, 1): skip_connection_input_2, (1, 2): pooled_skip_connection_input_2,
+            (2, 2): skip_connection_input_3, (2, 3): pooled_skip_connection_input_3,
+            (3, 3): skip_connection_input_4, (3, 4): pooled_skip_connection_input_4,
+        }
 
         x = self.decoder_block_4_upconv(x)
-        if tpt:
-            print("decoder_block_4_upconv shape", x.shape)
 
         # x = UNet.skip_connection(x, skip_connection_input_4)
-        x = UNetTCED.skip_connections(x, encoder_blocks_output)
+        x = self.skip_connections(x, 0, resampled)
 
-        if tpt3:
-            print("D x", x.shape, 'and skip_connection_input_4 shape', skip_connection_input_4.shape)
         x = self.decoder_block_4_conv1(x)
-        if tpt:
-            print("decoder_block_4_conv1 shape", x.shape)
         x = self.decoder_block_4_conv2(x)
-        if tpt:
-            print("decoder_block_4_conv2 shape", x.shape)
 
         x = self.decoder_block_3_upconv(x)
-        if tpt:
-            print("decoder_block_3_upconv shape", x.shape)
 
         # x = UNet.skip_connection(x, skip_connection_input_3)
-        x = UNetTCED.skip_connections(x, encoder_blocks_output)
+        x = self.skip_connections(x, 1, resampled)
 
-        if tpt3:
-            print("D x", x.shape, 'and skip_connection_input_3 shape', skip_connection_input_3.shape)
         x = self.decoder_block_3_conv1(x)
-        if tpt:
-            print("decoder_block_3_conv1 shape", x.shape)
         x = self.decoder_block_3_conv2(x)
-        if tpt:
-            print("decoder_block_3_conv2 shape", x.shape)
 
         x = self.decoder_block_2_upconv(x)
-        if tpt:
-            print("decoder_block_2_upconv shape", x.shape)
 
         # x = UNet.skip_connection(x, skip_connection_input_2)
-        x = UNetTCED.skip_connections(x, encoder_blocks_output)
+        x = self.skip_connections(x, 2, resampled)
 
-        if tpt3:
-            print("D x", x.shape, 'and skip_connection_input_2 shape', skip_connection_input_2.shape)
         x = self.decoder_block_2_conv1(x)
-        if tpt:
-            print("decoder_block_2_conv1 shape", x.shape)
         x = self.decoder_block_2_conv2(x)
-        if tpt:
-            print("decoder_block_2_conv2 shape", x.shape)
 
         x = self.decoder_block_1_upconv(x)
-        if tpt:
-            print("decoder_block_1_upconv shape", x.shape)
 
         # x = UNet.skip_connection(x, skip_connection_input_1)
-        x = UNetTCED.skip_connections(x, encoder_blocks_output)
+        x = self.skip_connections(x, 3, resampled)
 
-        if tpt3:
-            print("D x", x.shape, 'and skip_connection_input_1 shape', skip_connection_input_1.shape)
         x = self.decoder_block_1_conv1(x)
-        if tpt:
-            print("decoder_block_1_conv1 shape", x.shape)
         x = self.decoder_block_1_conv2(x)
-        if tpt:
-            print("decoder_block_1_conv2 shape", x.shape)
 
         x = self.output_block_0_conv(x)
-        if tpt:
-            print("output_block_0_conv shape", x.shape)
         x = self.output_block_0_output(x)
-        if tpt:
-            print("output_block_0_output shape", x.shape)
 
         return x
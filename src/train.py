@@ -1,33 +1,85 @@
+from models.resunet import ResUNet
 from models.unet_tced import UNetTCED
 from models.unet_std import UNetSTD
 from utils.data_utils import get_train_dataset
-from utils.model_utils import get_callbacks, get_latest_model
-from utils.values_utils import IMAGES_SRC, MASKS_SRC, VAL_SPLIT, BATCH_SIZE, EPOCHS, FILTERS, CLASSES, INPUT_SIZE
+from utils.distribute_utils import get_strategy, get_num_workers, is_chief, get_global_batch_size, shard_dataset
+from utils.model_utils import get_callbacks, get_latest_model, get_profiler
+from utils.precision_utils import set_precision
+from utils.sampling_utils import ImageSampler, SamplerCallback
+from utils.values_utils import IMAGES_SRC, MASKS_SRC, VAL_SPLIT, BATCH_SIZE, EPOCHS, FILTERS, CLASSES, INPUT_SIZE, \
+    NUM_THREADS, DATA_BACKEND, PRECISION, PROFILE_STEPS, STRATEGY, SHUFFLE_SEED, \
+    ACCUMULATION_STEPS, SAMPLING_MODE, AUGMENT
 
 
-def train_new_model(model_type, images_src=IMAGES_SRC, masks_src=MASKS_SRC, val_split=VAL_SPLIT, batch_size=BATCH_SIZE):
-    train_dataset, val_dataset = get_train_dataset(images_src, masks_src, val_split, batch_size)
-    if model_type == 'UNetTCED':
-        print("Model: UNet Tightly Connected Encoder and Decoder")
-        model = UNetTCED(FILTERS, CLASSES, INPUT_SIZE)
-    elif model_type == 'UNetResUNet':
-        model = None
-    else:
-        print("Model: Standard UNet")
-        model = UNetSTD(FILTERS, CLASSES, INPUT_SIZE)
+def get_distributed_train_dataset(strategy, images_src, masks_src, val_split, batch_size, num_threads, data_backend,
+                                  sampler=None, augment=AUGMENT):
+    # Workers keep every num_workers-th batch of the same shuffled order
+    seed = SHUFFLE_SEED if get_num_workers() > 1 else None
+    train_dataset, val_dataset = get_train_dataset(images_src, masks_src, val_split,
+                                                   get_global_batch_size(batch_size, strategy),
+                                                   num_threads=num_threads, data_backend=data_backend, seed=seed,
+                                                   sampler=sampler, augment=augment)
+
+    return shard_dataset(train_dataset), shard_dataset(val_dataset)
+
+
+def get_sampler(images_src, masks_src, val_split, sampling):
+    return ImageSampler.from_manifest(images_src, masks_src, val_split, sampling) if sampling else None
+
+
+def get_sampler_callbacks(sampler, batch_size):
+    return [SamplerCallback(sampler, batch_size=batch_size)] if sampler is not None else []
+
+
+def train_new_model(model_type, images_src=IMAGES_SRC, masks_src=MASKS_SRC, val_split=VAL_SPLIT, batch_size=BATCH_SIZE,
+                    num_threads=NUM_THREADS, data_backend=DATA_BACKEND, precision=PRECISION,
+                    profile_steps=PROFILE_STEPS, strategy=STRATEGY, epochs=EPOCHS,
+                    accumulation_steps=ACCUMULATION_STEPS, sampling=SAMPLING_MODE,
+                    augment=AUGMENT):
+    set_precision(precision)
+    strategy = get_strategy(strategy)
+    sampler = get_sampler(images_src, masks_src, val_split, sampling)
+    train_dataset, val_dataset = get_distributed_train_dataset(strategy, images_src, masks_src, val_split, batch_size,
+                                                               num_threads, data_backend, sampler,
+                                                               augment)
+    profiler = get_profiler(profile_steps=profile_steps, chief=is_chief(strategy))
+    with strategy.scope():
+        if model_type == 'UNetTCED':
+            print("Model: UNet Tightly Connected Encoder and Decoder")
+            model = UNetTCED(FILTERS, CLASSES, INPUT_SIZE, accumulation_steps)
+        elif model_type in ('ResUNet', 'UNetResUNet'):
+            print("Model: Res-U-Net")
+            model = ResUNet(FILTERS, CLASSES, INPUT_SIZE, accumulation_steps)
+        else:
+            print("Model: Standard UNet")
+            model = UNetSTD(FILTERS, CLASSES, INPUT_SIZE, accumulation_steps)
 
     print(model.summary())
-    model.fit(x=train_dataset,
-              epochs=EPOCHS,
+    model.fit(x=profiler.time_input(train_dataset),
+              epochs=epochs,
               validation_data=val_dataset,
-              callbacks=get_callbacks(model_type))
+              callbacks=get_sampler_callbacks(sampler, batch_size) +
+              get_callbacks(model_type, chief=is_chief(strategy), profiler=profiler))
 
 
-def train_from_ckpt(model_type, images_src=IMAGES_SRC, val_src=MASKS_SRC, val_split=VAL_SPLIT, batch_size=BATCH_SIZE):
-    train_dataset, val_dataset = get_train_dataset(images_src, val_src, val_split, batch_size)
-    model = get_latest_model(model_type)
+def train_from_ckpt(model_type, images_src=IMAGES_SRC, val_src=MASKS_SRC, val_split=VAL_SPLIT, batch_size=BATCH_SIZE,
+                     num_threads=NUM_THREADS, data_backend=DATA_BACKEND, precision=PRECISION,
+                     profile_steps=PROFILE_STEPS, strategy=STRATEGY, epochs=EPOCHS,
+                     accumulation_steps=ACCUMULATION_STEPS, sampling=SAMPLING_MODE,
+                     augment=AUGMENT):
+    set_precision(precision)
+    strategy = get_strategy(strategy)
+    sampler = get_sampler(images_src, val_src, val_split, sampling)
+    train_dataset, val_dataset = get_distributed_train_dataset(strategy, images_src, val_src, val_split, batch_size,
+                                                               num_threads, data_backend, sampler,
+                                                               augment)
+    profiler = get_profiler(profile_steps=profile_steps, chief=is_chief(strategy))
+    with strategy.scope():
+        model = get_latest_model(model_type, use_cache=False)
+    model.accumulation_steps = accumulation_steps
     print(model.summary)
-    model.fit(x=train_dataset,
-              epochs=EPOCHS,
+    model.fit(x=profiler.time_input(train_dataset),
+              epochs=epochs,
               validation_data=val_dataset,
-              callbacks=get_callbacks(model_type))
+              callbacks=get_sampler_callbacks(sampler, batch_size) +
+              get_callbacks(type(model).__name__, chief=is_chief(strategy), profiler=profiler))
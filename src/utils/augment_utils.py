@@ -0,0 +1,52 @@
+import tensorflow as tf
+
+from utils.values_utils import FLIP_PROBABILITY, MIN_CROP_SCALE, BRIGHTNESS_DELTA, CONTRAST_RANGE
+
+
+def get_crop_boxes(batch_size, min_scale=MIN_CROP_SCALE, flip_probability=FLIP_PROBABILITY):
+    """
+    Normalized [y1, x1, y2, x2] boxes of random crops of min_scale to 1 times the image side. Swapping x1 and x2
+    mirrors the crop, so the horizontal flip costs no extra pass over the batch.
+    """
+    scales = tf.random.uniform([batch_size, 1], min_scale, 1.0)
+    offsets = tf.random.uniform([batch_size, 2]) * (1.0 - scales)
+    y1, x1 = tf.split(offsets, 2, axis=1)
+    y2, x2 = y1 + scales, x1 + scales
+    flip = tf.random.uniform([batch_size, 1]) < flip_probability
+
+    return tf.concat([y1, tf.where(flip, x2, x1), y2, tf.where(flip, x1, x2)], axis=1)
+
+
+def random_crop_flip(images, masks):
+    """
+    Scale jitter and horizontal flip, resized back to the batch size. Images and masks share the crop boxes;
+    images are interpolated bilinearly, masks take the nearest class id.
+    """
+    batch_size = tf.shape(images)[0]
+    crop_size = tf.shape(images)[1:3]
+    boxes = get_crop_boxes(batch_size)
+    box_indices = tf.range(batch_size)
+
+    images = tf.image.crop_and_resize(images, boxes, box_indices, crop_size)
+    masks = tf.image.crop_and_resize(tf.cast(masks, tf.float32), boxes, box_indices, crop_size, method='nearest')
+
+    return images, tf.cast(masks, tf.uint8)
+
+
+def random_brightness_contrast(images, brightness_delta=BRIGHTNESS_DELTA, contrast_range=CONTRAST_RANGE):
+    batch_size = tf.shape(images)[0]
+    brightness = tf.random.uniform([batch_size, 1, 1, 1], -brightness_delta, brightness_delta)
+    contrast = tf.random.uniform([batch_size, 1, 1, 1], *contrast_range)
+    means = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+
+    return tf.clip_by_value((images - means) * contrast + means + brightness, 0.0, 1.0)
+
+
+def augment_batch(images, masks):
+    """
+    Random flips, scale jitter and brightness/contrast applied to a whole batch at once, with the same geometric
+    transform on every image and its mask.
+    """
+    images, masks = random_crop_flip(images, masks)
+
+    return random_brightness_contrast(images), masks
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import tensorflow as tf
+
+from glob import glob
+
+from utils.values_utils import CACHE_DIR, IMAGE_SHAPE, NUM_SHARDS
+
+META_FILE = "meta.json"
+SHARD_FILE = "shard-{:05d}.tfrecord"
+
+
+def get_cache_key(file_lists, shape=IMAGE_SHAPE):
+    """
+    Key of a preprocessed cache: changes whenever a source file is added, removed, reordered or modified,
+    or when the target size changes.
+    """
+    digest = hashlib.sha1(json.dumps(list(shape)).encode())
+    for file_list in file_lists:
+        for file_url in file_list:
+            stat = os.stat(file_url)
+            digest.update("{}|{}|{}\n".format(os.path.abspath(file_url), stat.st_mtime_ns, stat.st_size).encode())
+
+    return digest.hexdigest()[:16]
+
+
+def get_cache_prefix(name, file_lists):
+    source_dirs = sorted({os.path.abspath(os.path.dirname(x)) for file_list in file_lists for x in file_list})
+    digest = hashlib.sha1("\n".join(source_dirs).encode())
+
+    return name + '-' + digest.hexdigest()[:8]
+
+
+def remove_stale_caches(cache_dir, prefix, keep_path):
+    for stale_path in glob(os.path.join(cache_dir, prefix + '-*')):
+        if os.path.splitext(os.path.abspath(stale_path))[0] == os.path.abspath(keep_path):
+            continue
+        if os.path.isdir(stale_path):
+            shutil.rmtree(stale_path, ignore_errors=True)
+        else:
+            os.remove(stale_path)
+
+
+def bytes_feature(array):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[array.tobytes()]))
+
+
+def write_shards(dataset, shard_dir, shape, has_mask, num_shards=NUM_SHARDS):
+    """
+    Writes the uint8 elements of the dataset round robin over the shards, so that an interleave over the
+    shards with cycle_length=num_shards and block_length=1 gives back the original order.
+    """
+    tmp_dir = shard_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    writers = [tf.io.TFRecordWriter(os.path.join(tmp_dir, SHARD_FILE.format(i))) for i in range(num_shards)]
+    count = 0
+    for element in dataset.as_numpy_iterator():
+        if has_mask:
+            feature = {'image': bytes_feature(element[0]), 'mask': bytes_feature(element[1])}
+        else:
+            feature = {'image': bytes_feature(element)}
+        example = tf.train.Example(features=tf.train.Features(feature=feature))
+        writers[count % num_shards].write(example.SerializeToString())
+        count += 1
+    for writer in writers:
+        writer.close()
+
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as meta_file:
+        json.dump({'count': count, 'shape': list(shape), 'has_mask': has_mask, 'num_shards': num_shards}, meta_file)
+    os.replace(tmp_dir, shard_dir)
+
+
+def read_shards(shard_dir):
+    with open(os.path.join(shard_dir, META_FILE)) as meta_file:
+        meta = json.load(meta_file)
+    height, width = meta['shape']
+    has_mask = meta['has_mask']
+
+    features = {'image': tf.io.FixedLenFeature([], tf.string)}
+    if has_mask:
+        features['mask'] = tf.io.FixedLenFeature([], tf.string)
+
+    def parse_example(serialized):
+        example = tf.io.parse_single_example(serialized, features)
+        image = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (height, width, 3))
+        image = tf.image.convert_image_dtype(image, tf.float32)
+        if not has_mask:
+            return image
+        mask = tf.reshape(tf.io.decode_raw(example['mask'], tf.uint8), (height, width, 1))
+        return image, mask
+
+    shard_files = [os.path.join(shard_dir, SHARD_FILE.format(i)) for i in range(meta['num_shards'])]
+    dataset = tf.data.Dataset.from_tensor_slices(shard_files)
+    dataset = dataset.interleave(tf.data.TFRecordDataset,
+                                 cycle_length=len(shard_files),
+                                 block_length=1,
+                                 num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=True)
+    dataset = dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset
+
+
+def get_shard_dataset(name, file_lists, load_fn, cache_dir=CACHE_DIR, shape=IMAGE_SHAPE, num_shards=NUM_SHARDS):
+    """
+    Streams the preprocessed images (and masks) of file_lists from the shard cache, decoding and resizing
+    the source files with load_fn only when the cache is missing or stale.
+    """
+    prefix = get_cache_prefix(name, file_lists)
+    shard_dir = os.path.join(cache_dir, prefix + '-' + get_cache_key(file_lists, shape))
+
+    if not os.path.exists(os.path.join(shard_dir, META_FILE)):
+        remove_stale_caches(cache_dir, prefix, shard_dir)
+        files_dataset = tf.data.Dataset.from_tensor_slices(tuple(tf.constant(x) for x in file_lists))
+        dataset = files_dataset.map(load_fn, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+        write_shards(dataset, shard_dir, shape, has_mask=len(file_lists) == 2, num_shards=num_shards)
+
+    return read_shards(shard_dir)
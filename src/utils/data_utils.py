@@ -4,7 +4,12 @@ import os
 import tensorflow as tf
 
 from glob import glob
-from sklearn.model_selection import train_test_split
+
+from utils.augment_utils import augment_batch
+from utils.cache_utils import get_shard_dataset
+from utils.manifest_utils import get_manifest, get_manifest_splits
+from utils.mmap_utils import get_mmap_dataset
+from utils.values_utils import BUFFER_SIZE, NUM_THREADS, DATA_BACKEND, CACHE_DIR, SIZE_MULTIPLE, AUGMENT
 
 
 def get_file_url_list(url, file_format="png"):
@@ -14,12 +19,29 @@ def get_file_url_list(url, file_format="png"):
     return file_list
 
 
-def get_train_dataset_files(images_source_url, masks_source_url, validation_split):
-    images_list = get_file_url_list(images_source_url)
-    mask_list = get_file_url_list(masks_source_url)
+def get_dataset_options(num_threads=NUM_THREADS):
+    options = tf.data.Options()
+    # Only fuses a map directly followed by batch, as in the inference and evaluation pipelines: the training
+    # pipelines cache and shuffle the decoded images between the two
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    if num_threads:
+        # Cap the host threads used by this pipeline instead of the process wide pool
+        options.threading.private_threadpool_size = num_threads
+        options.threading.max_intra_op_parallelism = 1
+
+    return options
+
+
+def get_train_dataset_file_lists(images_source_url, masks_source_url, validation_split, cache_dir=CACHE_DIR):
+    manifest = get_manifest(images_source_url, masks_source_url, cache_dir=cache_dir)
 
-    x_train, x_test, y_train, y_test = train_test_split(images_list, mask_list,
-                                                        test_size=validation_split, random_state=40)
+    return get_manifest_splits(manifest, validation_split)
+
+
+def get_train_dataset_files(images_source_url, masks_source_url, validation_split, cache_dir=CACHE_DIR):
+    x_train, x_test, y_train, y_test = get_train_dataset_file_lists(images_source_url, masks_source_url,
+                                                                    validation_split, cache_dir)
 
     x_train = tf.constant(x_train)
     y_train = tf.constant(y_train)
@@ -33,23 +55,67 @@ def get_train_dataset_files(images_source_url, masks_source_url, validation_spli
     return train_dataset_files, test_dataset_files
 
 
-def get_train_dataset(images_source_url, masks_source_url, validation_split=0.2, batch_size=32):
-    train_dataset_files, val_dataset_files = get_train_dataset_files(images_source_url, masks_source_url,
-                                                                     validation_split)
-
-    train_dataset = train_dataset_files.map(read_image_mask)
-    train_dataset = train_dataset.map(resize_image_mask)
-
-    val_dataset = val_dataset_files.map(read_image_mask)
-    val_dataset = val_dataset.map(resize_image_mask)
-
-    train_dataset.batch(batch_size)
-    val_dataset.batch(batch_size)
-
-    train_dataset = train_dataset.cache().batch(batch_size)
-    val_dataset = val_dataset.cache().batch(batch_size)
-
-    return train_dataset, val_dataset
+def sample_dataset(dataset, sampler):
+    """
+    Sampler stage: repeats every (image, mask) of the training split, in the order of get_train_dataset_file_lists,
+    by the count the sampler draws from its weight for the current epoch.
+    """
+    indexed_dataset = tf.data.Dataset.zip((tf.data.Dataset.range(sampler.size), dataset))
+    sampler.score_dataset = indexed_dataset.map(lambda index, sample: (index, *sample))
+
+    return indexed_dataset.flat_map(
+        lambda index, sample: tf.data.Dataset.from_tensors(sample).repeat(sampler.get_repeat_count(index)))
+
+
+def get_train_dataset(images_source_url, masks_source_url, validation_split=0.2, batch_size=32,
+                      shuffle_buffer=BUFFER_SIZE, num_threads=NUM_THREADS, data_backend=DATA_BACKEND,
+                      cache_dir=CACHE_DIR, seed=None, sampler=None, augment=AUGMENT):
+    """
+    With a sampler (see utils.sampling_utils) the images of the training split are repeated by their sampled
+    counts every epoch instead of being seen exactly once. With augment, the training batches are augmented
+    after the cache, so every epoch sees new transforms.
+    """
+    options = get_dataset_options(num_threads)
+
+    if data_backend == 'mmap':
+        x_train, x_test, y_train, y_test = get_train_dataset_file_lists(images_source_url, masks_source_url,
+                                                                        validation_split, cache_dir)
+        train_dataset = get_mmap_dataset('train', (x_train, y_train), load_image_mask_uint8, batch_size,
+                                         shuffle=True, cache_dir=cache_dir, seed=seed, sampler=sampler)
+        val_dataset = get_mmap_dataset('val', (x_test, y_test), load_image_mask_uint8, batch_size,
+                                       cache_dir=cache_dir)
+
+        if augment:
+            train_dataset = train_dataset.map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+
+        return train_dataset.prefetch(tf.data.AUTOTUNE).with_options(options), \
+            val_dataset.prefetch(tf.data.AUTOTUNE).with_options(options)
+
+    if data_backend == 'shards':
+        x_train, x_test, y_train, y_test = get_train_dataset_file_lists(images_source_url, masks_source_url,
+                                                                        validation_split, cache_dir)
+        train_dataset = get_shard_dataset('train', (x_train, y_train), load_image_mask_uint8, cache_dir)
+        val_dataset = get_shard_dataset('val', (x_test, y_test), load_image_mask_uint8, cache_dir)
+    else:
+        train_dataset_files, val_dataset_files = get_train_dataset_files(images_source_url, masks_source_url,
+                                                                         validation_split, cache_dir)
+
+        train_dataset = train_dataset_files.map(load_image_mask, num_parallel_calls=tf.data.AUTOTUNE)
+        val_dataset = val_dataset_files.map(load_image_mask, num_parallel_calls=tf.data.AUTOTUNE)
+
+    train_dataset = train_dataset.cache()
+    if sampler is not None:
+        train_dataset = sample_dataset(train_dataset, sampler)
+    train_dataset = train_dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    val_dataset = val_dataset.cache()
+
+    train_dataset = train_dataset.batch(batch_size)
+    if augment:
+        train_dataset = train_dataset.map(augment_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    train_dataset = train_dataset.prefetch(tf.data.AUTOTUNE)
+    val_dataset = val_dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    return train_dataset.with_options(options), val_dataset.with_options(options)
 
 
 def get_inference_dataset_files(images_source_url):
@@ -62,29 +128,61 @@ def get_inference_dataset_files(images_source_url):
     return inference_dataset_files
 
 
-def get_inference_dataset(images_source_url, batch_size=32):
-    inference_files = get_inference_dataset_files(images_source_url)
+def get_inference_dataset(images_source_url, batch_size=32, num_threads=NUM_THREADS, data_backend=DATA_BACKEND,
+                          cache_dir=CACHE_DIR):
+    if data_backend == 'mmap':
+        images_list = get_file_url_list(images_source_url)
+        inference_dataset = get_mmap_dataset('inference', (images_list,), load_image_uint8, batch_size,
+                                             cache_dir=cache_dir)
+
+        return inference_dataset.prefetch(tf.data.AUTOTUNE).with_options(get_dataset_options(num_threads))
+
+    if data_backend == 'shards':
+        images_list = get_file_url_list(images_source_url)
+        inference_dataset = get_shard_dataset('inference', (images_list,), load_image_uint8, cache_dir)
+    else:
+        inference_files = get_inference_dataset_files(images_source_url)
+
+        inference_dataset = inference_files.map(load_image, num_parallel_calls=tf.data.AUTOTUNE)
 
-    inference_dataset = inference_files.map(read_image)
-    inference_dataset = inference_dataset.map(resize_image)
+    # Single pass over the folder, caching would only make memory grow with the folder size
+    inference_dataset = inference_dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
 
-    inference_dataset.batch(batch_size)
+    return inference_dataset.with_options(get_dataset_options(num_threads))
 
-    inference_dataset = inference_dataset.cache().batch(batch_size)
 
-    return inference_dataset
+def get_bucketed_inference_datasets(images_source_url, batch_size=32, multiple=SIZE_MULTIPLE, num_threads=NUM_THREADS):
+    """
+    Inference datasets at the native resolution of the images, rounded down to a multiple of the model stride.
+    Images are grouped by that shape, read from the PNG headers, so every batch has a single shape and the model
+    sees each shape once. Returns a list of (image urls, dataset) pairs.
+    """
+    buckets = {}
+    for image_url in get_file_url_list(images_source_url):
+        shape = get_multiple_shape(*get_image_size(image_url), multiple)
+        buckets.setdefault(shape, []).append(image_url)
 
+    datasets = []
+    for shape, images_list in buckets.items():
+        def load_image_at_shape(image_url, shape=shape):
+            return tf.image.resize(read_image(image_url), shape, method='nearest')
 
-def get_inference_dataset_numpy(numpy_images, batch_size=32):
+        inference_dataset = tf.data.Dataset.from_tensor_slices(tf.constant(images_list))
+        inference_dataset = inference_dataset.map(load_image_at_shape, num_parallel_calls=tf.data.AUTOTUNE)
+        inference_dataset = inference_dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        datasets.append((images_list, inference_dataset.with_options(get_dataset_options(num_threads))))
+
+    return datasets
+
+
+def get_inference_dataset_numpy(numpy_images, batch_size=32, num_threads=NUM_THREADS):
 
     images_list = tf.constant(numpy_images)
 
     images_list_tensors = tf.data.Dataset.from_tensor_slices(images_list)
 
-    inference_dataset = images_list_tensors.map(resize_image)
-
-    inference_dataset.batch(batch_size)
+    inference_dataset = images_list_tensors.map(resize_image, num_parallel_calls=tf.data.AUTOTUNE)
 
-    inference_dataset = inference_dataset.cache().batch(batch_size)
+    inference_dataset = inference_dataset.cache().batch(batch_size).prefetch(tf.data.AUTOTUNE)
 
-    return inference_dataset
+    return inference_dataset.with_options(get_dataset_options(num_threads))
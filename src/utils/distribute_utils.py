@@ -0,0 +1,51 @@
+import json
+import os
+import tensorflow as tf
+
+from utils.values_utils import STRATEGY
+
+
+def get_strategy(strategy=STRATEGY):
+    """
+    'default' trains on a single device, 'mirrored' replicates the model on the local devices and 'multi_worker'
+    across the processes listed in the TF_CONFIG environment variable.
+    """
+    if strategy == 'mirrored':
+        return tf.distribute.MirroredStrategy()
+    if strategy == 'multi_worker':
+        return tf.distribute.MultiWorkerMirroredStrategy()
+
+    return tf.distribute.get_strategy()
+
+
+def get_num_workers():
+    cluster = json.loads(os.environ.get('TF_CONFIG', '{}')).get('cluster', {})
+    return max(len(cluster.get('chief', [])) + len(cluster.get('worker', [])), 1)
+
+
+def is_chief(strategy):
+    """
+    The chief is the 'chief' task or worker 0 when the cluster has none; single process strategies are always chief.
+    """
+    resolver = getattr(strategy, 'cluster_resolver', None)
+    if resolver is None or not resolver.task_type:
+        return True
+    if resolver.task_type == 'chief':
+        return True
+
+    return resolver.task_type == 'worker' and resolver.task_id == 0 and \
+        'chief' not in resolver.cluster_spec().as_dict()
+
+
+def get_global_batch_size(batch_size, strategy):
+    # batch_size is per replica, each step consumes one batch on every replica
+    return batch_size * strategy.num_replicas_in_sync
+
+
+def shard_dataset(dataset):
+    # The pipelines start from lists of file names rather than file datasets, so the workers share the same files
+    # and keep every num_workers-th batch; this needs the same shuffle seed on all of them
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+    return dataset.with_options(options)
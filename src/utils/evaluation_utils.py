@@ -0,0 +1,137 @@
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from concurrent.futures import ThreadPoolExecutor
+
+from models.inference_model import InferenceModel
+from utils.data_utils import get_dataset_options, get_train_dataset_files
+from utils.image_utils import load_image_mask
+from utils.manifest_utils import get_manifest
+from utils.metrics_utils import get_confusion_matrix, get_class_iou, get_mean_iou, get_frequency_weighted_iou
+from utils.model_utils import load_model
+from utils.values_utils import CLASSES, CACHE_DIR, NUM_THREADS, VAL_SPLIT, EVALUATION_REPORT_PATH
+
+
+def get_evaluation_dataset(images_source_url, masks_source_url, batch_size=32, num_threads=NUM_THREADS,
+                           cache_dir=CACHE_DIR):
+    """
+    Every image and mask pair of the manifest of the folders, batched and not cached, so memory stays bounded by
+    the prefetched batches whatever the folder size.
+    """
+    samples = get_manifest(images_source_url, masks_source_url, cache_dir=cache_dir)['samples']
+    dataset = tf.data.Dataset.from_tensor_slices(([x['image'] for x in samples], [x['mask'] for x in samples]))
+    dataset = dataset.map(load_image_mask, num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE).with_options(get_dataset_options(num_threads))
+
+
+def get_evaluation_report(confusion):
+    return {'pixel_accuracy': float(np.trace(confusion) / max(confusion.sum(), 1)),
+            'mean_iou': get_mean_iou(confusion),
+            'fw_iou': get_frequency_weighted_iou(confusion),
+            'class_iou': [None if np.isnan(x) else float(x) for x in get_class_iou(confusion)]}
+
+
+def evaluate_models(predict_masks, dataset, classes=CLASSES, parallel=False):
+    """
+    Scores several models in a single pass over a dataset of (images, masks) batches: every batch is decoded once
+    and fed to all of them. predict_masks maps names to callables returning (batch, height, width, 1) class ids
+    like InferenceModel. With parallel, the models score each batch concurrently, which makes their latencies
+    include the contention. Only the confusion matrices are kept between batches.
+    """
+    confusions = {name: np.zeros((classes, classes), dtype=np.int64) for name in predict_masks}
+    seconds = {name: 0.0 for name in predict_masks}
+    count = 0
+
+    def score(name, images, masks, warm_up):
+        if warm_up:
+            # Keeps the tracing of the first call out of the latency
+            predict_masks[name](images)
+        start = time.perf_counter()
+        predictions = predict_masks[name](images).numpy()
+        seconds[name] += time.perf_counter() - start
+        confusions[name] += get_confusion_matrix(masks, predictions, classes)
+
+    with ThreadPoolExecutor(max_workers=len(predict_masks) if parallel else 1) as executor:
+        for images, masks in dataset:
+            masks = masks.numpy()
+            list(executor.map(lambda name: score(name, images, masks, count == 0), predict_masks))
+            count += len(images)
+
+    reports = {}
+    for name in predict_masks:
+        reports[name] = get_evaluation_report(confusions[name])
+        reports[name]['images'] = count
+        reports[name]['ms_per_image'] = seconds[name] * 1000.0 / max(count, 1)
+
+    return reports
+
+
+def evaluate_dataset(predict_mask, dataset, classes=CLASSES):
+    return evaluate_models({'model': predict_mask}, dataset, classes)['model']
+
+
+def evaluate_folder(predict_mask, images_source_url, masks_source_url, batch_size=32, num_threads=NUM_THREADS):
+    return evaluate_dataset(predict_mask, get_evaluation_dataset(images_source_url, masks_source_url, batch_size,
+                                                                 num_threads))
+
+
+def get_validation_dataset(images_source_url, masks_source_url, validation_split=VAL_SPLIT, batch_size=32,
+                           num_threads=NUM_THREADS):
+    _, val_dataset_files = get_train_dataset_files(images_source_url, masks_source_url, validation_split)
+    val_dataset = val_dataset_files.map(load_image_mask, num_parallel_calls=tf.data.AUTOTUNE)
+
+    return val_dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE).with_options(get_dataset_options(num_threads))
+
+
+def get_checkpoint_keys(entries):
+    """
+    Report key of every entry: its file name, or its absolute path when checkpoints of different directories share
+    that name. Entries of the same file get the same key and are scored once.
+    """
+    paths = {}
+    for entry in entries:
+        paths.setdefault(entry['name'], set()).add(os.path.abspath(entry['path']))
+
+    return [entry['name'] if len(paths[entry['name']]) == 1 else os.path.abspath(entry['path']) for entry in entries]
+
+
+def compare_checkpoints(entries, images_source_url, masks_source_url, validation_split=VAL_SPLIT, batch_size=32,
+                        num_threads=NUM_THREADS, parallel=False, report_path=EVALUATION_REPORT_PATH):
+    """
+    Scores the registry entries on the validation split, decoded once for all of them, and reports the mIoU,
+    the frequency weighted IoU, the per class IoU, the latency per image and the parameter count of each.
+    """
+    keys = get_checkpoint_keys(entries)
+    models = {key: load_model(entry) for key, entry in zip(keys, entries)}
+    dataset = get_validation_dataset(images_source_url, masks_source_url, validation_split, batch_size, num_threads)
+    reports = evaluate_models({name: InferenceModel(model) for name, model in models.items()}, dataset,
+                              parallel=parallel)
+    for key, entry in zip(keys, entries):
+        reports[key].update({'variant': entry['variant'], 'path': entry['path'], 'params': models[key].count_params()})
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w') as report_file:
+        json.dump(reports, report_file, indent=2)
+
+    names = list(reports)
+    print("{:>3} {:<36} {:<10} {:>10} {:>8} {:>8} {:>10}".format("#", "checkpoint", "variant", "params", "mIoU",
+                                                               "FW-IoU", "ms/image"))
+    for i, name in enumerate(names):
+        report = reports[name]
+        print("{:>3} {:<36} {:<10} {:>10} {:>8.4f} {:>8.4f} {:>10.2f}".format(i, name, report['variant'],
+                                                                           report['params'], report['mean_iou'],
+                                                                           report['fw_iou'],
+                                                                           report['ms_per_image']))
+    print("{:>6}".format("class") + "".join("{:>9}".format("#" + str(i)) for i in range(len(names))))
+    for class_id in range(len(reports[names[0]]['class_iou'])):
+        ious = [reports[name]['class_iou'][class_id] for name in names]
+        if all(iou is None for iou in ious):
+            continue
+        print("{:>6}".format(class_id) + "".join("{:>9}".format("-" if iou is None else "{:.4f}".format(iou))
+                                                 for iou in ious))
+
+    return reports
@@ -1,9 +1,20 @@
+import struct
 import tensorflow as tf
 
+from utils.values_utils import IMAGE_SHAPE, SIZE_MULTIPLE
 
-def read_image(image_url):
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def decode_image(image_url):
     image = tf.io.read_file(image_url)
     image = tf.image.decode_png(image, channels=3)
+
+    return image
+
+
+def read_image(image_url):
+    image = decode_image(image_url)
     image = tf.image.convert_image_dtype(image, tf.float32)  # this also set the value between 0 and 1
 
     return image
@@ -17,14 +28,14 @@ def read_mask(mask_url):
 
 
 def resize_image(image):
-    shape = (96, 128)
+    shape = IMAGE_SHAPE
     image = tf.image.resize(image, shape, method='nearest')
 
     return image
 
 
 def resize_mask(mask):
-    shape = (96, 128)
+    shape = IMAGE_SHAPE
     mask = tf.image.resize(mask, shape, method='nearest')
 
     return mask
@@ -38,5 +49,46 @@ def resize_image_mask(image, mask):
     return resize_image(image), resize_mask(mask)
 
 
+def load_image(image_url):
+    return resize_image(read_image(image_url))
+
+
+def load_image_mask(image_url, mask_url):
+    return resize_image_mask(*read_image_mask(image_url, mask_url))
+
+
+def load_image_uint8(image_url):
+    return resize_image(decode_image(image_url))
+
+
+def load_image_mask_uint8(image_url, mask_url):
+    return resize_image_mask(decode_image(image_url), read_mask(mask_url))
+
+
+def get_image_size(image_url):
+    """
+    (height, width) read from the IHDR chunk of a PNG without decoding it, other formats are decoded.
+    """
+    with open(image_url, 'rb') as image_file:
+        header = image_file.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', header[16:24])
+        return height, width
+    shape = tf.image.decode_image(tf.io.read_file(image_url), expand_animations=False).shape
+
+    return shape[0], shape[1]
+
+
+def get_multiple_shape(height, width, multiple=SIZE_MULTIPLE):
+    return max(height // multiple, 1) * multiple, max(width // multiple, 1) * multiple
+
+
+def resize_image_to_multiple(image, multiple=SIZE_MULTIPLE):
+    shape = get_multiple_shape(tf.shape(image)[0], tf.shape(image)[1], multiple)
+    image = tf.image.resize(image, shape, method='nearest')
+
+    return image
+
+
 def get_image_from_array(array):
     return tf.keras.preprocessing.image.array_to_img(array)
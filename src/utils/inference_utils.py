@@ -0,0 +1,38 @@
+import tensorflow as tf
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from models.inference_model import InferenceModel
+from utils.image_utils import get_image_from_array
+from utils.values_utils import WRITER_THREADS, MAX_PENDING_BATCHES
+
+
+def save_mask(mask, path):
+    get_image_from_array(mask).save(path)
+
+
+def stream_predictions(model, inference_dataset, output_paths, writer_threads=WRITER_THREADS,
+                       max_pending_batches=MAX_PENDING_BATCHES):
+    """
+    Predicts the dataset batch by batch, reducing the logits to uint8 masks on the device, while a thread
+    pool encodes and writes the masks of the previous batches. At most max_pending_batches batches of masks
+    are held in memory, whatever the size of the dataset.
+    """
+    predict_mask = InferenceModel(model) if isinstance(model, tf.keras.Model) else model
+    pending_batches = deque()
+    count = 0
+    with ThreadPoolExecutor(max_workers=writer_threads) as executor:
+        for images in inference_dataset:
+            masks = predict_mask(images).numpy()
+            pending_batches.append([executor.submit(save_mask, mask, output_paths[count + i])
+                                    for i, mask in enumerate(masks)])
+            count += len(masks)
+            while len(pending_batches) > max_pending_batches:
+                for future in pending_batches.popleft():
+                    future.result()
+        for batch_futures in pending_batches:
+            for future in batch_futures:
+                future.result()
+
+    return count
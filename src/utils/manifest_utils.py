@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from sklearn.model_selection import train_test_split
+
+from utils.image_utils import get_image_size, read_mask
+from utils.values_utils import CACHE_DIR, CLASSES, MANIFEST_WORKERS
+
+MANIFEST_VERSION = 2
+
+# manifest path -> (manifest mtime, source state, manifest) of the manifests validated by this process
+loaded_manifests = {}
+
+
+def get_stem(file_url):
+    return os.path.splitext(os.path.basename(file_url))[0]
+
+
+def get_manifest_path(images_source_url, masks_source_url, cache_dir=CACHE_DIR):
+    digest = hashlib.sha1("{}\n{}".format(os.path.abspath(images_source_url),
+                                          os.path.abspath(masks_source_url)).encode())
+
+    return os.path.join(cache_dir, "manifest-" + digest.hexdigest()[:16] + ".json")
+
+
+def get_source_state(images_source_url, masks_source_url):
+    # Adding, removing or renaming files updates the mtime of their directory
+    return [os.stat(images_source_url).st_mtime_ns, os.stat(masks_source_url).st_mtime_ns]
+
+
+def get_pair_state(image_url, mask_url):
+    # Size and mtime of both files, overwriting a file in place changes them without touching its directory
+    image_stat, mask_stat = os.stat(image_url), os.stat(mask_url)
+    return [image_stat.st_size, image_stat.st_mtime_ns, mask_stat.st_size, mask_stat.st_mtime_ns]
+
+
+def is_unchanged(sample):
+    try:
+        return sample['state'] == get_pair_state(sample['image'], sample['mask'])
+    except OSError:
+        return False
+
+
+def get_class_histogram(mask_url, classes=CLASSES):
+    return np.bincount(read_mask(mask_url).numpy().ravel(), minlength=classes)
+
+
+def describe_pair(image_url, mask_url, classes=CLASSES):
+    """
+    Manifest sample of an image and its mask, or None and the reason the pair is rejected.
+    """
+    try:
+        state = get_pair_state(image_url, mask_url)
+        image_size = get_image_size(image_url)
+        mask_size = get_image_size(mask_url)
+        if tuple(image_size) != tuple(mask_size):
+            return None, "size mismatch {} {}".format(tuple(image_size), tuple(mask_size))
+        histogram = get_class_histogram(mask_url, classes)
+    except (OSError, ValueError, tf.errors.OpError) as error:
+        return None, "unreadable ({})".format(type(error).__name__)
+    if len(histogram) > classes:
+        return None, "class id {} out of range".format(len(histogram) - 1)
+
+    return {'stem': get_stem(image_url),
+            'image': image_url,
+            'mask': mask_url,
+            'state': state,
+            'height': int(image_size[0]),
+            'width': int(image_size[1]),
+            'histogram': histogram.tolist()}, None
+
+
+def build_manifest(images_source_url, masks_source_url, manifest_path, file_format="png", classes=CLASSES,
+                   num_workers=MANIFEST_WORKERS, previous=None):
+    """
+    Pairs images and masks by file stem, checks that both have the same size from the PNG headers and stores the
+    per image class histograms of the masks. Unpaired, unreadable and invalid samples are left out and listed under
+    'rejected'. The samples of a previous manifest whose files are unchanged are kept without reading them again.
+    """
+    state = get_source_state(images_source_url, masks_source_url)
+    images = {get_stem(x): x for x in glob(os.path.join(images_source_url, "*" + file_format))}
+    masks = {get_stem(x): x for x in glob(os.path.join(masks_source_url, "*" + file_format))}
+    stems = sorted(images.keys() & masks.keys())
+    unchanged = {(sample['image'], sample['mask']): sample for sample in (previous or {}).get('samples', [])
+                 if is_unchanged(sample)}
+
+    def describe(stem):
+        sample = unchanged.get((images[stem], masks[stem]))
+        return (sample, None) if sample is not None else describe_pair(images[stem], masks[stem], classes)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        described = list(executor.map(describe, stems))
+
+    rejected = [{'stem': stem, 'reason': "no mask"} for stem in sorted(images.keys() - masks.keys())]
+    rejected += [{'stem': stem, 'reason': "no image"} for stem in sorted(masks.keys() - images.keys())]
+    rejected += [{'stem': stem, 'reason': reason} for stem, (_, reason) in zip(stems, described) if reason]
+    if rejected:
+        print("Manifest: {} samples rejected, see {}".format(len(rejected), manifest_path))
+
+    manifest = {'version': MANIFEST_VERSION,
+                'images_source_url': os.path.abspath(images_source_url),
+                'masks_source_url': os.path.abspath(masks_source_url),
+                'source_state': state,
+                'file_format': file_format,
+                'classes': classes,
+                'samples': [sample for sample, _ in described if sample],
+                'rejected': rejected}
+
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    # Workers of a multi worker run may build the same manifest at once, each writes its own file
+    tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_path, manifest_path)
+
+    return manifest
+
+
+def get_manifest(images_source_url, masks_source_url, file_format="png", classes=CLASSES, cache_dir=CACHE_DIR,
+                 rebuild=False):
+    """
+    Manifest of the dataset, updated when files were added to or removed from the source folders or a sample file
+    was overwritten. Only the changed pairs are read again; the rejected ones are always retried on an update.
+    The sample files are checked once per process, later calls only compare the mtimes of the manifest and of the
+    source folders.
+    """
+    manifest_path = get_manifest_path(images_source_url, masks_source_url, cache_dir)
+    source_state = get_source_state(images_source_url, masks_source_url)
+    manifest = None
+    if not rebuild and os.path.exists(manifest_path):
+        manifest_mtime = os.stat(manifest_path).st_mtime_ns
+        loaded = loaded_manifests.get(manifest_path)
+        if loaded is not None and loaded[:2] == (manifest_mtime, source_state) and \
+                loaded[2]['file_format'] == file_format and loaded[2]['classes'] == classes:
+            return loaded[2]
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != MANIFEST_VERSION or manifest['file_format'] != file_format or \
+                manifest['classes'] != classes:
+            manifest = None
+        elif manifest['source_state'] == source_state and all(is_unchanged(sample) for sample in manifest['samples']):
+            loaded_manifests[manifest_path] = (manifest_mtime, source_state, manifest)
+            return manifest
+
+    manifest = build_manifest(images_source_url, masks_source_url, manifest_path, file_format, classes,
+                              previous=manifest)
+    loaded_manifests[manifest_path] = (os.stat(manifest_path).st_mtime_ns, manifest['source_state'], manifest)
+
+    return manifest
+
+
+def get_manifest_splits(manifest, validation_split):
+    samples = manifest['samples']
+    train_samples, val_samples = train_test_split(samples, test_size=validation_split, random_state=40)
+
+    return [x['image'] for x in train_samples], [x['image'] for x in val_samples], \
+        [x['mask'] for x in train_samples], [x['mask'] for x in val_samples]
+
+
+def get_class_histograms(manifest, image_urls):
+    histograms = {sample['image']: sample['histogram'] for sample in manifest['samples']}
+
+    return np.asarray([histograms[x] for x in image_urls], dtype=np.int64)
@@ -0,0 +1,141 @@
+import numpy as np
+import tensorflow as tf
+
+from utils.values_utils import CLASSES
+
+
+def get_confusion_matrix(y_true, y_pred, classes=CLASSES):
+    """
+    Rows are the true classes and columns the predicted classes.
+    """
+    y_true = np.asarray(y_true, dtype=np.int64).reshape(-1)
+    y_pred = np.asarray(y_pred, dtype=np.int64).reshape(-1)
+    confusion = np.bincount(classes * y_true + y_pred, minlength=classes * classes)
+
+    return confusion.reshape(classes, classes)
+
+
+def get_class_iou(confusion):
+    """
+    Per class intersection over union, nan for the classes absent from both the masks and the predictions.
+    """
+    intersection = np.diag(confusion).astype(np.float64)
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, np.nan)
+
+
+def get_mean_iou(confusion):
+    return float(np.nanmean(get_class_iou(confusion)))
+
+
+def get_frequency_weighted_iou(confusion):
+    """
+    IoU of every class weighted by its share of the true pixels.
+    """
+    frequencies = confusion.sum(axis=1) / max(confusion.sum(), 1)
+    return float(np.nansum(frequencies * get_class_iou(confusion)))
+
+
+def get_class_iou_tensor(confusion):
+    confusion = tf.cast(confusion, tf.float64)
+    intersection = tf.linalg.diag_part(confusion)
+    union = tf.reduce_sum(confusion, axis=0) + tf.reduce_sum(confusion, axis=1) - intersection
+
+    return intersection, union
+
+
+class ConfusionMatrix(tf.keras.metrics.Metric):
+    """
+    Streaming confusion matrix of the argmax of the logits against the true masks, updated with one bincount per
+    batch. Rows are the true classes and columns the predicted classes; class ids out of range are ignored.
+    Subclasses reduce it to a score.
+    """
+
+    def __init__(self, classes=CLASSES, name='confusion_matrix', **kwargs):
+        super(ConfusionMatrix, self).__init__(name=name, **kwargs)
+        self.classes = classes
+        self.confusion = self.add_weight(name='confusion', shape=(classes, classes), initializer='zeros',
+                                         dtype=tf.int64)
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        y_true = tf.reshape(tf.cast(y_true, tf.int32), [-1])
+        # The int64 argmax is the one of the accuracy metric, the graph optimizer computes it once for all metrics
+        y_pred = tf.reshape(tf.cast(tf.argmax(y_pred, axis=-1), tf.int32), [-1])
+        size = self.classes * self.classes
+        # Out of range pairs are moved past maxlength, which bincount drops
+        pairs = tf.where(tf.logical_and(y_true >= 0, y_true < self.classes), y_true * self.classes + y_pred, size)
+        confusion = tf.math.bincount(pairs, minlength=size, maxlength=size, dtype=tf.int64)
+        self.confusion.assign_add(tf.reshape(confusion, (self.classes, self.classes)))
+
+    def result(self):
+        return self.confusion
+
+    def reset_state(self):
+        self.confusion.assign(tf.zeros_like(self.confusion))
+
+    def get_config(self):
+        config = super(ConfusionMatrix, self).get_config()
+        config['classes'] = self.classes
+        return config
+
+
+class MeanIoU(ConfusionMatrix):
+    """
+    Mean IoU over the classes present in the masks or in the predictions.
+    """
+
+    def __init__(self, classes=CLASSES, name='mean_iou', **kwargs):
+        super(MeanIoU, self).__init__(classes, name=name, **kwargs)
+
+    def result(self):
+        intersection, union = get_class_iou_tensor(self.confusion)
+        present = tf.cast(union > 0, tf.float64)
+        # 0 rather than nan before any pixel was counted
+        return tf.cast(tf.math.divide_no_nan(tf.reduce_sum(tf.math.divide_no_nan(intersection, union)),
+                                             tf.reduce_sum(present)), tf.float32)
+
+
+class FrequencyWeightedIoU(tf.keras.metrics.Metric):
+    """
+    Frequency weighted IoU read from the confusion matrix of a MeanIoU metric, so both scores come from a single
+    bincount per batch. It neither updates nor resets that matrix and must be compiled with its MeanIoU.
+    """
+
+    def __init__(self, confusion_metric, name='fw_iou', **kwargs):
+        super(FrequencyWeightedIoU, self).__init__(name=name, **kwargs)
+        self.confusion_metric = confusion_metric
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        pass
+
+    def result(self):
+        confusion = self.confusion_metric.confusion
+        intersection, union = get_class_iou_tensor(confusion)
+        frequencies = tf.reduce_sum(tf.cast(confusion, tf.float64), axis=1) / \
+            tf.maximum(tf.cast(tf.reduce_sum(confusion), tf.float64), 1.0)
+        return tf.cast(tf.reduce_sum(tf.math.divide_no_nan(frequencies * intersection, union)), tf.float32)
+
+    def reset_state(self):
+        pass
+
+
+class ClassIoULogger(tf.keras.callbacks.Callback):
+    """
+    Adds the validation IoU of every class, val_iou_<class>, to the epoch logs. It reads the confusion matrix the
+    mean IoU metric accumulated over the validation run, so it costs nothing per step.
+    Must come before the callbacks recording the logs, and run on every worker of a multi worker job: reading the
+    matrix sums it across the workers.
+    """
+
+    def __init__(self, metric_name='mean_iou'):
+        super(ClassIoULogger, self).__init__()
+        self.metric_name = metric_name
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None or 'val_' + self.metric_name not in logs:
+            return
+        for metric in self.model.metrics:
+            if metric.name == self.metric_name:
+                for i, iou in enumerate(get_class_iou(metric.confusion.numpy())):
+                    logs['val_iou_{}'.format(i)] = float(iou)
@@ -0,0 +1,91 @@
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from utils.cache_utils import get_cache_key, get_cache_prefix, remove_stale_caches
+from utils.values_utils import CACHE_DIR, IMAGE_SHAPE
+
+STORE_EXTENSION = ".u8"
+INDEX_EXTENSION = ".json"
+
+
+def build_mmap_store(store_path, file_lists, load_fn, shape=IMAGE_SHAPE):
+    """
+    Writes all samples into a single (count, height, width, channels) uint8 array file. The first three
+    channels hold the RGB image and, when masks are given, the last one holds the class ids of the mask.
+    """
+    count = len(file_lists[0])
+    channels = 4 if len(file_lists) == 2 else 3
+    tmp_path = store_path + '.tmp'
+
+    store = np.memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(count, *shape, channels))
+
+    files_dataset = tf.data.Dataset.from_tensor_slices(tuple(tf.constant(x) for x in file_lists))
+    dataset = files_dataset.map(load_fn, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    for i, element in enumerate(dataset.as_numpy_iterator()):
+        if channels == 4:
+            store[i, ..., :3] = element[0]
+            store[i, ..., 3:] = element[1]
+        else:
+            store[i] = element
+    store.flush()
+    del store
+
+    with open(store_path + INDEX_EXTENSION, 'w') as index_file:
+        json.dump({'count': count, 'shape': list(shape), 'channels': channels,
+                   'files': [list(x) for x in zip(*file_lists)]}, index_file)
+    os.replace(tmp_path, store_path + STORE_EXTENSION)
+
+
+def open_mmap_store(store_path):
+    with open(store_path + INDEX_EXTENSION) as index_file:
+        index = json.load(index_file)
+    # Read only mapping, processes opening the same store share the pages through the OS page cache
+    store = np.memmap(store_path + STORE_EXTENSION, mode='r', dtype=np.uint8,
+                      shape=(index['count'], *index['shape'], index['channels']))
+
+    return store, index
+
+
+def get_mmap_dataset(name, file_lists, load_fn, batch_size=32, shuffle=False, cache_dir=CACHE_DIR,
+                     shape=IMAGE_SHAPE, seed=None, sampler=None):
+    """
+    Batched dataset gathering samples straight from the memory-mapped store, building the store first when it
+    is missing or stale. Images are normalized to float32 per batch, masks stay uint8 class ids.
+    """
+    prefix = get_cache_prefix('mmap-' + name, file_lists)
+    store_path = os.path.join(cache_dir, prefix + '-' + get_cache_key(file_lists, shape))
+
+    if not os.path.exists(store_path + STORE_EXTENSION):
+        os.makedirs(cache_dir, exist_ok=True)
+        remove_stale_caches(cache_dir, prefix, store_path)
+        build_mmap_store(store_path, file_lists, load_fn, shape)
+
+    store, index = open_mmap_store(store_path)
+    has_mask = index['channels'] == 4
+    height, width = index['shape']
+
+    def gather_batch(indices):
+        records = tf.numpy_function(lambda x: store[x], [indices], tf.uint8)
+        records = tf.reshape(records, (-1, height, width, index['channels']))
+        images = tf.image.convert_image_dtype(records[..., :3], tf.float32)
+        if not has_mask:
+            return images
+        return images, records[..., 3:]
+
+    def gather_sample(sample_index):
+        images, masks = gather_batch(tf.reshape(sample_index, [1]))
+        return sample_index, images[0], masks[0]
+
+    dataset = tf.data.Dataset.range(index['count'])
+    if sampler is not None:
+        sampler.score_dataset = dataset.map(gather_sample)
+        dataset = dataset.flat_map(
+            lambda sample_index: tf.data.Dataset.from_tensors(sample_index).repeat(
+                sampler.get_repeat_count(sample_index)))
+    if shuffle:
+        dataset = dataset.shuffle(index['count'], seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(gather_batch, num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset
@@ -1,48 +1,115 @@
 import tensorflow as tf
-import glob
 import os
 
+from collections import OrderedDict
 from tensorflow.python.keras.callbacks import CSVLogger
 
+from models.resunet import ResUNet
+from models.unet_std import UNetSTD
 from models.unet_tced import UNetTCED
+from utils.metrics_utils import ClassIoULogger
+from utils.profiling_utils import TrainingProfiler
+from utils.registry_utils import ModelRegistry, RegistryCallback
 from utils.values_utils import LOGGER_DIR, TENSORBOARD_LOG_DIR, CLASSES, \
-    FILTERS, INPUT_SIZE, CURR_DATETIME, MODEL_DIR, MODEL_EXTENSION
+    FILTERS, INPUT_SIZE, CURR_DATETIME, MODEL_DIR, MODEL_EXTENSION, MODEL_VARIANT, MODEL_CACHE_SIZE, REGISTRY_PATH, \
+    MONITOR, MONITOR_MODE, PROFILE_STEPS
+
+MODEL_VARIANTS = {'UNetSTD': UNetSTD, 'UNetTCED': UNetTCED, 'ResUNet': ResUNet, 'UNetResUNet': ResUNet}
+
+registries = {}
+model_cache = OrderedDict()
+
+
+def get_variant_name(model_type):
+    if model_type not in MODEL_VARIANTS:
+        return MODEL_VARIANT
+    return MODEL_VARIANTS[model_type].__name__
+
+
+def build_model(model_type, filters=FILTERS, classes=CLASSES, input_size=INPUT_SIZE):
+    return MODEL_VARIANTS[get_variant_name(model_type)](filters, classes, input_size)
+
+
+def get_registry(registry_path=REGISTRY_PATH):
+    if registry_path not in registries:
+        registries[registry_path] = ModelRegistry(registry_path, get_variant_name)
+    return registries[registry_path]
+
+
+def get_profiler(tensorboard_dir=TENSORBOARD_LOG_DIR, profile_steps=PROFILE_STEPS, chief=True):
+    return TrainingProfiler(tensorboard_dir, profile_steps if chief else None)
 
 
 def get_callbacks(model_type, ckpt_dir=MODEL_DIR, ckpt_datetime=CURR_DATETIME, ckpt_extension=MODEL_EXTENSION,
-                  logger_dir=LOGGER_DIR, tensorboard_dir=TENSORBOARD_LOG_DIR):
-    ckpt_path = ckpt_dir + ckpt_datetime + '_' + model_type + ckpt_extension
+                  logger_dir=LOGGER_DIR, tensorboard_dir=TENSORBOARD_LOG_DIR, profile_steps=PROFILE_STEPS,
+                  chief=True, profiler=None):
+    variant = get_variant_name(model_type)
+    ckpt_path = ckpt_dir + ckpt_datetime + '_' + variant + ckpt_extension
     checkpoint = tf.keras.callbacks.ModelCheckpoint(filepath=ckpt_path,
                                                     save_weights_only=True,
-                                                    monitor='val_accuracy',
-                                                    mode='max',
+                                                    monitor=MONITOR,
+                                                    mode=MONITOR_MODE,
                                                     save_best_only=True)
+    registry = RegistryCallback(get_registry(), ckpt_path, variant, ckpt_datetime)
 
-    reduce_lr = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_accuracy',
+    reduce_lr = tf.keras.callbacks.ReduceLROnPlateau(monitor=MONITOR,
+                                                     mode=MONITOR_MODE,
                                                      patience=3)
-    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy',
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor=MONITOR,
+                                                      mode=MONITOR_MODE,
                                                       patience=3)
+    # Before TensorBoard and the CSV logger, which record the epoch logs it adds
+    if profiler is None:
+        profiler = get_profiler(tensorboard_dir, profile_steps, chief)
+    class_iou = ClassIoULogger()
     tensorboard = tf.keras.callbacks.TensorBoard(log_dir=tensorboard_dir)
 
     csv_logger = CSVLogger(logger_dir)
 
-    callbacks = [checkpoint, reduce_lr, early_stopping, tensorboard, csv_logger]
+    if not chief:
+        # Workers run the same train function and react to the same synchronized metrics, only the chief writes.
+        # The class IoU logger reads the confusion matrix with a collective every worker has to join
+        return [reduce_lr, early_stopping, profiler, class_iou]
+
+    callbacks = [checkpoint, registry, reduce_lr, early_stopping, profiler, class_iou, tensorboard, csv_logger]
 
     return callbacks
 
 
-def get_latest_model(model_type):
-    model = UNetTCED(FILTERS, CLASSES, INPUT_SIZE)
-    all_models_names = [os.path.basename(x) for x in glob.glob(os.path.join(MODEL_DIR, "*.hdf5"))]
-    all_models_names_sliced = [x[:15] for x in all_models_names]
-    latest_ts = max(all_models_names_sliced)
-    latest_ts_ind = all_models_names_sliced.index(latest_ts)
-    latest_model_name = all_models_names[latest_ts_ind]
-    latest_model = os.path.join(MODEL_DIR, latest_model_name)
-    model.load_weights(latest_model)
+def load_model(entry, use_cache=True):
+    """
+    Model built from a registry entry. Built models are kept in a process wide LRU cache, so repeated calls neither
+    rebuild them nor reload weights; use_cache=False returns a private copy, e.g. to resume training.
+    """
+    cache_key = (os.path.abspath(entry['path']), os.path.getmtime(entry['path']),
+                 tf.keras.mixed_precision.global_policy().name)
+    if use_cache and cache_key in model_cache:
+        model_cache.move_to_end(cache_key)
+        return model_cache[cache_key]
+
+    model = build_model(entry['variant'], entry['filters'], entry['classes'], entry['input_shape'])
+    model.load_weights(entry['path'])
+    if use_cache:
+        model_cache[cache_key] = model
+        while len(model_cache) > MODEL_CACHE_SIZE:
+            model_cache.popitem(last=False)
+
     return model
 
 
+def get_latest_model(model_type=None, which='latest', use_cache=True):
+    """
+    Model built from the latest (or best) checkpoint of the variant, of any variant when model_type is None.
+    """
+    return load_model(get_registry().resolve(model_type, which), use_cache)
+
+
 def generate_prediction(model, input_image):
     prediction = model.predict(input_image)
     return prediction
+
+
+def generate_mask(inference_model, input_images):
+    if isinstance(input_images, tf.data.Dataset):
+        return tf.concat([inference_model(images) for images in input_images], axis=0)
+    return inference_model(input_images)
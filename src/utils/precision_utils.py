@@ -0,0 +1,19 @@
+import tensorflow as tf
+
+from utils.values_utils import PRECISION
+
+
+def set_precision(precision=PRECISION):
+    """
+    Sets the Keras dtype policy of the models built afterwards: 'float32', 'mixed_float16' or 'mixed_bfloat16'.
+    """
+    tf.keras.mixed_precision.set_global_policy(precision)
+
+
+def get_optimizer():
+    optimizer = tf.keras.optimizers.Adam()
+    if tf.keras.mixed_precision.global_policy().name == 'mixed_float16':
+        # float16 gradients underflow without loss scaling, bfloat16 has the float32 range and does not need it
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    return optimizer
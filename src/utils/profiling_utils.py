@@ -0,0 +1,130 @@
+import time
+import tensorflow as tf
+
+from utils.trace_utils import BlockTracer
+from utils.values_utils import TENSORBOARD_LOG_DIR, PROFILE_STEPS, BLOCK_SAMPLES
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident memory of the process since it started, not of the current epoch.
+    """
+    if resource is None:
+        return float('nan')
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class TrainingProfiler(tf.keras.callbacks.Callback):
+    """
+    Per epoch instrumentation of training: time waiting on the input pipeline versus compute, steps/sec, images/sec,
+    lifetime peak host RSS and per block forward times of a sample batch. The numbers are added to the epoch logs, so
+    the TensorBoard and CSV callbacks placed after it record them. A TF profiler trace of the global steps
+    [start, stop) is written to the log dir when profile_steps is given.
+
+    The input wait is only measured on a training dataset passed through time_input: its last stage stamps the moment
+    each batch reaches the train function, and the wait of a step is the time from the start of the step to the
+    arrival of its first batch. Without it the whole step counts as compute.
+    """
+
+    def __init__(self, log_dir=TENSORBOARD_LOG_DIR, profile_steps=PROFILE_STEPS, block_samples=BLOCK_SAMPLES):
+        super().__init__()
+        # The batch hooks only take timestamps, the step logs do not need to be copied to the host
+        self._supports_tf_logs = True
+        self.log_dir = log_dir
+        self.profile_steps = profile_steps
+        self.block_samples = block_samples
+        self.global_step = 0
+        self.profiling = False
+        self.timed_input = False
+        self.step_start = None
+        self.arrival = None
+        self.sample = None
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.images = 0
+        self.input_wait = 0.0
+        self.compute = 0.0
+        self.epoch_start = time.perf_counter()
+
+    def time_input(self, dataset):
+        """
+        The dataset with a last stage recording the arrival time and the size of every batch.
+        """
+        def stamp(images, num_images):
+            if self.arrival is None:
+                self.arrival = time.perf_counter()
+            self.images += int(num_images)
+            self.sample = images.numpy()
+            return num_images
+
+        def timed(images, *rest):
+            # Pulled by the train function itself, after any prefetch of the pipeline
+            stamped = tf.py_function(stamp, [images[:1], tf.shape(images)[0]], tf.int32)
+            with tf.control_dependencies([stamped]):
+                images = tf.identity(images)
+            return (images,) + rest
+
+        options = tf.data.Options()
+        if hasattr(options.experimental_optimization, 'inject_prefetch'):
+            # A prefetch injected after the stamp would take the arrival times ahead of the steps
+            options.experimental_optimization.inject_prefetch = False
+        self.timed_input = True
+
+        return dataset.map(timed).with_options(options)
+
+    def on_train_end(self, logs=None):
+        if self.profiling:
+            tf.profiler.experimental.stop()
+            self.profiling = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.reset()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps is not None and self.global_step == self.profile_steps[0]:
+            tf.profiler.experimental.start(self.log_dir)
+            self.profiling = True
+        self.arrival = None
+        self.step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        step_time = time.perf_counter() - self.step_start
+        input_wait = min(max(self.arrival - self.step_start, 0.0), step_time) if self.arrival is not None else 0.0
+        self.input_wait += input_wait
+        self.compute += step_time - input_wait
+        self.steps += 1
+        self.global_step += 1
+        if self.profiling and self.global_step == self.profile_steps[1]:
+            tf.profiler.experimental.stop()
+            self.profiling = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None:
+            return
+        train_time = self.input_wait + self.compute
+        if self.timed_input:
+            logs['input_wait_s'] = self.input_wait
+            logs['input_wait_fraction'] = self.input_wait / train_time if train_time else 0.0
+            logs['images_per_sec'] = self.images / train_time if train_time else 0.0
+        logs['compute_s'] = self.compute
+        logs['steps_per_sec'] = self.steps / train_time if train_time else 0.0
+        logs['epoch_time_s'] = time.perf_counter() - self.epoch_start
+        logs['lifetime_peak_rss_mb'] = get_peak_rss_mb()
+        logs.update(self.sample_block_times())
+
+    def sample_block_times(self):
+        if self.sample is None or not self.block_samples:
+            return {}
+        with BlockTracer(self.model) as tracer:
+            for _ in range(self.block_samples):
+                self.model(self.sample, training=False)
+
+        return {'block_ms_' + block['block']: block['ms'] / self.block_samples for block in tracer.summary()}
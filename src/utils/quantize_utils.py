@@ -0,0 +1,118 @@
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from models.inference_model import InferenceModel
+from utils.data_utils import get_file_url_list, get_train_dataset
+from utils.image_utils import load_image
+from utils.metrics_utils import get_confusion_matrix, get_class_iou, get_mean_iou
+from utils.values_utils import CLASSES, NUM_CALIBRATION_SAMPLES, TFLITE_PATH, QUANTIZATION_REPORT_PATH, \
+    INFERENCE_THREADS, IMAGE_SHAPE, SHUFFLE_SEED
+
+
+def get_representative_dataset(images_source_url, num_samples=NUM_CALIBRATION_SAMPLES, seed=SHUFFLE_SEED):
+    # A seeded random subset of the folder rather than its first files in glob order
+    images_list = get_file_url_list(images_source_url)
+    images_list = [images_list[i] for i in np.random.RandomState(seed).permutation(len(images_list))[:num_samples]]
+    calibration_dataset = tf.data.Dataset.from_tensor_slices(tf.constant(images_list)).map(
+        load_image, num_parallel_calls=tf.data.AUTOTUNE).batch(1)
+
+    def representative_dataset():
+        for images in calibration_dataset:
+            yield [images]
+
+    return representative_dataset
+
+
+def export_int8_tflite(model, images_source_url, tflite_path=TFLITE_PATH, num_samples=NUM_CALIBRATION_SAMPLES):
+    """
+    Post-training full integer quantization of the fused forward + argmax graph, calibrated on num_samples images
+    of images_source_url. Input stays float32 and output is the uint8 mask, like InferenceModel.
+    """
+    inference_model = InferenceModel(model)
+    # TFLite needs static spatial dimensions, only the batch dimension stays open
+    predict_mask = tf.function(lambda images: inference_model(images)).get_concrete_function(
+        tf.TensorSpec(shape=[None, IMAGE_SHAPE[0], IMAGE_SHAPE[1], 3], dtype=tf.float32))
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([predict_mask], inference_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = get_representative_dataset(images_source_url, num_samples)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    os.makedirs(os.path.dirname(tflite_path), exist_ok=True)
+    with open(tflite_path, 'wb') as tflite_file:
+        tflite_file.write(converter.convert())
+
+    return tflite_path
+
+
+class TFLiteInferenceModel:
+    """
+    CPU inference backend running the quantized model, called like InferenceModel on a float32 batch of images.
+    """
+
+    def __init__(self, tflite_path=TFLITE_PATH, num_threads=INFERENCE_THREADS):
+        self.interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_shape = None
+
+    def __call__(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        if self.input_shape != images.shape:
+            self.interpreter.resize_tensor_input(self.input_index, images.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = images.shape
+        self.interpreter.set_tensor(self.input_index, images)
+        self.interpreter.invoke()
+
+        return tf.convert_to_tensor(self.interpreter.get_tensor(self.output_index))
+
+
+def compare_quantized_model(model, tflite_model, images_source_url, masks_source_url, validation_split,
+                            batch_size=32, report_path=QUANTIZATION_REPORT_PATH):
+    """
+    Scores the float and the quantized model on the validation split against the true masks, reporting the per
+    class IoU, the mIoU and the latency per image of both, and the pixel agreement between them.
+    """
+    _, val_dataset = get_train_dataset(images_source_url, masks_source_url, validation_split, batch_size)
+    backends = {'float': InferenceModel(model), 'int8': tflite_model}
+    confusions = {name: np.zeros((CLASSES, CLASSES), dtype=np.int64) for name in backends}
+    seconds = {name: 0.0 for name in backends}
+    agreement = 0
+    count = 0
+    for images, masks in val_dataset:
+        predictions = {}
+        for name, backend in backends.items():
+            start = time.perf_counter()
+            predictions[name] = backend(images).numpy()
+            seconds[name] += time.perf_counter() - start
+            confusions[name] += get_confusion_matrix(masks.numpy(), predictions[name])
+        agreement += int(np.sum(predictions['float'] == predictions['int8']))
+        count += len(images)
+
+    report = {'images': count,
+              'pixel_agreement': agreement / max(count * int(np.prod(val_dataset.element_spec[1].shape[1:])), 1)}
+    for name in backends:
+        report[name] = {'mean_iou': get_mean_iou(confusions[name]),
+                        'class_iou': [None if np.isnan(x) else float(x) for x in get_class_iou(confusions[name])],
+                        'ms_per_image': seconds[name] * 1000.0 / max(count, 1)}
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    print("{:>6} {:>10} {:>10} {:>10}".format("class", "float", "int8", "delta"))
+    for i, (float_iou, int8_iou) in enumerate(zip(report['float']['class_iou'], report['int8']['class_iou'])):
+        if float_iou is None or int8_iou is None:
+            continue
+        print("{:>6} {:>10.4f} {:>10.4f} {:>+10.4f}".format(i, float_iou, int8_iou, int8_iou - float_iou))
+    print("{:>6} {:>10.4f} {:>10.4f} {:>+10.4f}".format("mIoU", report['float']['mean_iou'],
+                                                         report['int8']['mean_iou'],
+                                                         report['int8']['mean_iou'] - report['float']['mean_iou']))
+    print("ms/image float {:.2f}, int8 {:.2f}, pixel agreement {:.4f}".format(report['float']['ms_per_image'],
+                                                                              report['int8']['ms_per_image'],
+                                                                              report['pixel_agreement']))
+
+    return report
@@ -0,0 +1,195 @@
+import json
+import os
+import tensorflow as tf
+
+from datetime import datetime
+from glob import glob
+
+from utils.values_utils import MODEL_DIR, MODEL_EXTENSION, REGISTRY_PATH, TIMESTAMP_FORMAT, FILTERS, CLASSES, \
+    INPUT_SIZE, MONITOR, MONITOR_MODE, CHECKPOINT_SELECTIONS
+
+ANY_VARIANT = '*'
+
+
+class ModelRegistry:
+    """
+    Index of the saved checkpoints with their variant, timestamp, input shape, classes and validation metric.
+    The index keeps the name of the latest and of the best checkpoint of every variant (and of any variant),
+    so resolving them does not scan the model directory.
+    variant_name maps a model type, e.g. the -v argument or the suffix of a legacy checkpoint, to the variant name
+    checkpoints are registered under.
+    """
+
+    def __init__(self, index_path=REGISTRY_PATH, variant_name=None):
+        self.index_path = index_path
+        self.variant_name = variant_name if variant_name is not None else (lambda model_type: model_type)
+        self.index_mtime = None
+        self.index = {'checkpoints': {}, 'latest': {}, 'best': {}}
+        self.reload()
+
+    def reload(self):
+        if not os.path.exists(self.index_path):
+            return
+        index_mtime = os.path.getmtime(self.index_path)
+        if index_mtime != self.index_mtime:
+            with open(self.index_path) as index_file:
+                self.index = json.load(index_file)
+            self.index_mtime = index_mtime
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as index_file:
+            json.dump(self.index, index_file, indent=2)
+        os.replace(tmp_path, self.index_path)
+        self.index_mtime = os.path.getmtime(self.index_path)
+
+    def is_better(self, entry, other_name, mode=MONITOR_MODE):
+        other = self.index['checkpoints'].get(other_name)
+        if other is None or other['value'] is None:
+            return True
+        if entry['value'] is None:
+            return False
+        # Scores of another metric, e.g. from before MONITOR changed, are not comparable
+        if other.get('metric') != entry['metric']:
+            return True
+        return entry['value'] > other['value'] if mode == 'max' else entry['value'] < other['value']
+
+    @staticmethod
+    def make_entry(path, variant, timestamp, value=None, metric=MONITOR, filters=FILTERS, classes=CLASSES,
+                   input_shape=INPUT_SIZE):
+        return {'name': os.path.basename(path),
+                'path': path,
+                'variant': variant,
+                'timestamp': timestamp,
+                'input_shape': list(input_shape),
+                'filters': filters,
+                'classes': classes,
+                'metric': metric,
+                'value': value}
+
+    def parse_name(self, path, model_extension=MODEL_EXTENSION):
+        """
+        Timestamp and variant of a checkpoint named <timestamp>_<variant><extension>, None for any other name.
+        """
+        name = os.path.basename(path)
+        if not name.endswith(model_extension):
+            return None
+        timestamp, _, variant = name[:-len(model_extension)].partition('_')
+        try:
+            datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            return None
+
+        return timestamp, self.variant_name(variant)
+
+    def register(self, path, variant, timestamp, value=None, metric=MONITOR, mode=MONITOR_MODE, filters=FILTERS,
+                 classes=CLASSES, input_shape=INPUT_SIZE, save=True):
+        entry = self.make_entry(path, variant, timestamp, value, metric, filters, classes, input_shape)
+        name = entry['name']
+        self.index['checkpoints'][name] = entry
+        for key in (variant, ANY_VARIANT):
+            latest = self.index['checkpoints'].get(self.index['latest'].get(key))
+            if latest is None or latest['timestamp'] <= timestamp:
+                self.index['latest'][key] = name
+            if self.is_better(entry, self.index['best'].get(key), mode):
+                self.index['best'][key] = name
+        if save:
+            self.save()
+
+        return entry
+
+    def scan(self, model_dir=MODEL_DIR, model_extension=MODEL_EXTENSION):
+        """
+        Registers the checkpoints named <timestamp>_<variant><extension> saved before the index existed.
+        """
+        for path in sorted(glob(os.path.join(model_dir, "*" + model_extension))):
+            parsed = self.parse_name(path, model_extension)
+            if os.path.basename(path) in self.index['checkpoints'] or parsed is None:
+                continue
+            timestamp, variant = parsed
+            self.register(path, variant, timestamp, save=False)
+        self.save()
+
+    @staticmethod
+    def check_selection(which):
+        if which not in CHECKPOINT_SELECTIONS:
+            raise ValueError("Checkpoint selection {} is not one of {}".format(which, CHECKPOINT_SELECTIONS))
+
+    def resolve(self, variant=None, which='latest'):
+        self.check_selection(which)
+        self.reload()
+        key = self.variant_name(variant) if variant is not None else ANY_VARIANT
+        name = self.index[which].get(key)
+        if name is None:
+            self.scan()
+            name = self.index[which].get(key)
+        if name is None:
+            raise FileNotFoundError("No {} checkpoint of {} in {}".format(which, key, self.index_path))
+
+        return self.index['checkpoints'][name]
+
+    def resolve_all(self, which='best'):
+        """
+        The latest or best checkpoint of every variant.
+        """
+        self.check_selection(which)
+        self.reload()
+        if not self.index[which]:
+            self.scan()
+
+        return [self.index['checkpoints'][name] for variant, name in sorted(self.index[which].items())
+                if variant != ANY_VARIANT]
+
+    def get(self, name_or_path):
+        """
+        Entry of a registered checkpoint by name, or of a checkpoint file by path. A file outside the index gets an
+        entry built from its <timestamp>_<variant> name with the default filters, classes and input shape, without
+        being registered.
+        """
+        self.reload()
+        name = os.path.basename(name_or_path)
+        entry = self.index['checkpoints'].get(name)
+        if os.path.isfile(name_or_path) and (entry is None or not os.path.exists(entry['path']) or
+                                             not os.path.samefile(entry['path'], name_or_path)):
+            parsed = self.parse_name(name_or_path)
+            if parsed is None:
+                raise ValueError("Checkpoint {} is not named <timestamp>_<variant>{}".format(name_or_path,
+                                                                                             MODEL_EXTENSION))
+            return self.make_entry(name_or_path, parsed[1], parsed[0])
+        if name not in self.index['checkpoints']:
+            self.scan()
+        if name not in self.index['checkpoints']:
+            raise FileNotFoundError("No checkpoint {} in {}".format(name, self.index_path))
+
+        return self.index['checkpoints'][name]
+
+
+class RegistryCallback(tf.keras.callbacks.Callback):
+    """
+    Registers the checkpoint written by ModelCheckpoint(save_best_only=True) each time the monitored metric improves.
+    Must come after the ModelCheckpoint callback.
+    """
+
+    def __init__(self, registry, ckpt_path, variant, timestamp, monitor=MONITOR, mode=MONITOR_MODE,
+                 input_shape=INPUT_SIZE):
+        super(RegistryCallback, self).__init__()
+        self.registry = registry
+        self.ckpt_path = ckpt_path
+        self.variant = variant
+        self.timestamp = timestamp
+        self.monitor = monitor
+        self.mode = mode
+        self.input_shape = input_shape
+        self.best = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is None or not os.path.exists(self.ckpt_path):
+            return
+        value = float(value)
+        if self.best is None or (value > self.best if self.mode == 'max' else value < self.best):
+            self.best = value
+            self.registry.register(self.ckpt_path, self.variant, self.timestamp, value, self.monitor, self.mode,
+                                   filters=self.model.filters, classes=self.model.classes,
+                                   input_shape=self.input_shape)
@@ -0,0 +1,100 @@
+import numpy as np
+import tensorflow as tf
+
+from utils.manifest_utils import get_manifest, get_manifest_splits, get_class_histograms
+from utils.values_utils import CACHE_DIR, VAL_SPLIT, BATCH_SIZE, SHUFFLE_SEED, SAMPLING_POWER, MAX_SAMPLE_WEIGHT, \
+    HARD_EXAMPLE_FRACTION, HARD_EXAMPLE_MOMENTUM, SAMPLING_MODES
+
+
+def get_class_balanced_weights(histograms, power=SAMPLING_POWER, max_weight=MAX_SAMPLE_WEIGHT):
+    """
+    Image weights favouring rare classes: the pixel share of every class in the image weighted by the inverse
+    dataset frequency of the class raised to power, normalized to a mean of 1.
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    frequencies = histograms.sum(axis=0) / histograms.sum()
+    class_weights = np.where(frequencies > 0, np.maximum(frequencies, 1e-12) ** -power, 0.0)
+    weights = (histograms / np.maximum(histograms.sum(axis=1, keepdims=True), 1)) @ class_weights
+
+    return normalize_weights(weights, max_weight)
+
+
+def normalize_weights(weights, max_weight=MAX_SAMPLE_WEIGHT):
+    weights = np.clip(weights / weights.mean(), 1.0 / max_weight, max_weight)
+    return weights / weights.mean()
+
+
+class ImageSampler:
+    """
+    Sampling weights of the images of the training split, in the order of get_train_dataset_file_lists.
+    'balanced' weights come from the class histograms of the manifest, 'hard' weights start uniform and follow the
+    recent loss of every image through SamplerCallback. Each epoch, image i is repeated floor(n * w_i + u) times
+    with u uniform, so an epoch keeps n images on average.
+    """
+
+    def __init__(self, histograms, mode='balanced', power=SAMPLING_POWER, seed=SHUFFLE_SEED):
+        if mode not in SAMPLING_MODES:
+            raise ValueError("Sampling mode {} is not one of {}".format(mode, SAMPLING_MODES))
+        self.mode = mode
+        self.power = power
+        self.seed = seed
+        self.size = len(histograms)
+        initial_weights = get_class_balanced_weights(histograms, power) if mode == 'balanced' else np.ones(self.size)
+        self.weights = tf.Variable(initial_weights / self.size, dtype=tf.float32, trainable=False)
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.losses = np.full(self.size, np.nan)
+        # (index, image, mask) of the training split, set by the sampler stage of the input pipeline
+        self.score_dataset = None
+
+    @classmethod
+    def from_manifest(cls, images_source_url, masks_source_url, validation_split=VAL_SPLIT, mode='balanced',
+                      cache_dir=CACHE_DIR):
+        manifest = get_manifest(images_source_url, masks_source_url, cache_dir=cache_dir)
+        x_train, _, _, _ = get_manifest_splits(manifest, validation_split)
+
+        return cls(get_class_histograms(manifest, x_train), mode)
+
+    def get_uniform(self, index):
+        # Stateless, so every worker of a distributed run draws the same epoch
+        return tf.random.stateless_uniform([], seed=tf.stack([self.epoch * self.size + index, self.seed]))
+
+    def get_repeat_count(self, index):
+        expected = tf.gather(self.weights, index) * self.size
+        return tf.cast(tf.floor(expected + self.get_uniform(index)), tf.int64)
+
+    def update_losses(self, indices, losses, momentum=HARD_EXAMPLE_MOMENTUM):
+        previous = self.losses[indices]
+        self.losses[indices] = np.where(np.isnan(previous), losses, momentum * previous + (1 - momentum) * losses)
+
+    def update_weights(self):
+        # Images not scored yet keep the mean loss
+        losses = np.where(np.isnan(self.losses), np.nanmean(self.losses), self.losses)
+        weights = normalize_weights(np.maximum(losses, 1e-12) ** self.power)
+        self.weights.assign(weights / self.size)
+
+
+class SamplerCallback(tf.keras.callbacks.Callback):
+    """
+    Advances the sampling epoch and, in 'hard' mode, scores a random fraction of the training images with the
+    current model to update their recent loss and sampling weight.
+    """
+
+    def __init__(self, sampler, fraction=HARD_EXAMPLE_FRACTION, batch_size=BATCH_SIZE):
+        super(SamplerCallback, self).__init__()
+        self.sampler = sampler
+        self.fraction = fraction
+        self.batch_size = batch_size
+        self.loss = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True,
+                                                                  reduction=tf.keras.losses.Reduction.NONE)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.sampler.mode == 'hard':
+            score_dataset = self.sampler.score_dataset.filter(
+                lambda index, *_: self.sampler.get_uniform(index) < self.fraction).batch(self.batch_size)
+            for indices, images, masks in score_dataset:
+                losses = tf.reduce_mean(self.loss(masks, self.model(images, training=False)), axis=[1, 2])
+                self.sampler.update_losses(indices.numpy(), losses.numpy())
+            self.sampler.update_weights()
+            if logs is not None:
+                logs['max_sample_weight'] = float(tf.reduce_max(self.sampler.weights)) * self.sampler.size
+        self.sampler.epoch.assign_add(1)
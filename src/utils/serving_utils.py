@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.image_utils import resize_image
+from utils.values_utils import BATCH_SIZE, BATCH_DEADLINE_MS, SERVER_HOST, SERVER_PORT, IMAGE_SHAPE
+
+
+class MicroBatcher:
+    """
+    Gathers the images of concurrent requests into batches of up to max_batch_size images, waiting at most
+    deadline_ms after the first image of a batch, and runs predict_mask once per batch from a single thread.
+    """
+
+    def __init__(self, predict_mask, max_batch_size=BATCH_SIZE, deadline_ms=BATCH_DEADLINE_MS):
+        self.predict_mask = predict_mask
+        self.max_batch_size = max_batch_size
+        self.deadline_ms = deadline_ms
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self.requests.put((image, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.deadline_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                masks = np.asarray(self.predict_mask(np.stack([image for image, _ in batch])))
+                for (_, future), mask in zip(batch, masks):
+                    future.set_result(mask)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+def decode_request_image(body):
+    image = tf.io.decode_image(body, channels=3, expand_animations=False)
+    image = tf.image.convert_image_dtype(image, tf.float32)
+
+    return resize_image(image).numpy()
+
+
+def get_error_message(error):
+    # The message of a TF error starts with the op, which the client does not need
+    message = error.message if isinstance(error, tf.errors.OpError) else str(error)
+    return "{}: {}".format(type(error).__name__, message.split('}}')[-1].strip() or message)
+
+
+def get_request_handler(batcher):
+    class SegmentationRequestHandler(BaseHTTPRequestHandler):
+        """
+        POST /segment with a PNG or JPEG body returns the PNG mask of class ids, 400 when the body cannot be decoded
+        and 500 when the model fails. GET /health returns 200.
+        """
+
+        def do_GET(self):
+            if self.path != '/health':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.end_headers()
+
+        def do_POST(self):
+            if self.path != '/segment':
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                image = decode_request_image(body)
+            except (tf.errors.OpError, ValueError) as e:
+                self.send_error(400, "Body is not a PNG or JPEG image", get_error_message(e))
+                return
+            try:
+                mask = batcher.submit(image).result()
+                png = tf.io.encode_png(mask).numpy()
+            except Exception as e:
+                self.send_error(500, "Segmentation failed", get_error_message(e))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(png)))
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SegmentationRequestHandler
+
+
+def serve(predict_mask, host=SERVER_HOST, port=SERVER_PORT, max_batch_size=BATCH_SIZE,
+          deadline_ms=BATCH_DEADLINE_MS):
+    # Traces the model once before the first request
+    predict_mask(np.zeros((1, IMAGE_SHAPE[0], IMAGE_SHAPE[1], 3), dtype=np.float32))
+    batcher = MicroBatcher(predict_mask, max_batch_size, deadline_ms)
+    server = ThreadingHTTPServer((host, port), get_request_handler(batcher))
+    print("Serving on http://{}:{}/segment".format(host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
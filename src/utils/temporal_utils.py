@@ -0,0 +1,76 @@
+import numpy as np
+
+from utils.values_utils import REUSE_THRESHOLD, KEYFRAME_INTERVAL, REUSE_STRIDE
+
+
+class TemporalReuse:
+    """
+    Wraps a predict_mask callable for consecutive video frames.
+    The change of every frame is measured as the mean absolute difference of a strided grayscale thumbnail against
+    the last fully segmented frame. Frames below the threshold reuse the previous mask and the model runs on the
+    others, and at least once every keyframe_interval frames. With measure_drift the model also runs on the skipped
+    frames to measure the fraction of pixels where the reused mask differs from the full inference.
+    """
+
+    def __init__(self, predict_mask, threshold=REUSE_THRESHOLD, keyframe_interval=KEYFRAME_INTERVAL,
+                 measure_drift=False, stride=REUSE_STRIDE):
+        self.predict_mask = predict_mask
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.measure_drift = measure_drift
+        self.stride = stride
+        self.reference = None
+        self.last_mask = None
+        self.since_keyframe = 0
+        self.frames = 0
+        self.skipped = 0
+        self.drift_pixels = 0
+        self.drift_total = 0
+
+    def get_thumbnails(self, images):
+        return np.asarray(images)[:, ::self.stride, ::self.stride].mean(axis=-1)
+
+    def select_keyframes(self, thumbnails):
+        keyframes = []
+        for i, thumbnail in enumerate(thumbnails):
+            if self.reference is None or self.since_keyframe + 1 >= self.keyframe_interval or \
+                    np.abs(thumbnail - self.reference).mean() > self.threshold:
+                keyframes.append(i)
+                self.reference = thumbnail
+                self.since_keyframe = 0
+            else:
+                self.since_keyframe += 1
+
+        return keyframes
+
+    def __call__(self, images):
+        images = np.asarray(images)
+        keyframes = self.select_keyframes(self.get_thumbnails(images))
+        keyframe_masks = np.asarray(self.predict_mask(images[keyframes])) if keyframes else None
+
+        masks = []
+        keyframe_masks_iter = iter(keyframe_masks if keyframe_masks is not None else [])
+        keyframe_set = set(keyframes)
+        for i in range(len(images)):
+            if i in keyframe_set:
+                self.last_mask = next(keyframe_masks_iter)
+            masks.append(self.last_mask)
+        masks = np.stack(masks)
+
+        skipped = [i for i in range(len(images)) if i not in keyframe_set]
+        if self.measure_drift and skipped:
+            full_masks = np.asarray(self.predict_mask(images[skipped]))
+            self.drift_pixels += int(np.sum(full_masks != masks[skipped]))
+            self.drift_total += full_masks.size
+        self.frames += len(images)
+        self.skipped += len(skipped)
+
+        return masks
+
+    def stats(self):
+        stats = {'frames': self.frames,
+                 'skipped_fraction': self.skipped / self.frames if self.frames else 0.0}
+        if self.measure_drift:
+            stats['mask_drift'] = self.drift_pixels / self.drift_total if self.drift_total else 0.0
+
+        return stats
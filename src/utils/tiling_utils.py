@@ -0,0 +1,84 @@
+import numpy as np
+import tensorflow as tf
+
+from collections import deque
+
+from utils.values_utils import IMAGE_SHAPE, TILE_OVERLAP, BATCH_SIZE
+
+
+def get_tile_positions(length, tile_length, overlap):
+    stride = max(tile_length - overlap, 1)
+    positions = list(range(0, max(length - tile_length, 0) + 1, stride))
+    if positions[-1] + tile_length < length:
+        positions.append(length - tile_length)
+
+    return positions
+
+
+def get_tile_weights(tile_shape=IMAGE_SHAPE):
+    """
+    Pyramid weights, highest at the center of a tile and small but positive at its borders, so that overlapping
+    tiles blend smoothly.
+    """
+    axes = [np.minimum(np.arange(1, n + 1), np.arange(n, 0, -1)).astype(np.float32) for n in tile_shape]
+
+    return np.outer(axes[0], axes[1]) / (max(axes[0]) * max(axes[1]))
+
+
+def get_logits_function(model, tile_shape=IMAGE_SHAPE):
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, tile_shape[0], tile_shape[1], 3], dtype=tf.float32)])
+    def predict_logits(tiles):
+        return tf.cast(model(tiles, training=False), tf.float32)
+
+    return predict_logits
+
+
+def tiled_predict(predict_logits, images, tile_shape=IMAGE_SHAPE, overlap=TILE_OVERLAP, batch_size=BATCH_SIZE):
+    """
+    Segments images of any size at full resolution by running the model on overlapping tiles.
+    Tiles of consecutive images share batches, and the weighted logits of every tile are added to a per-image
+    accumulator as soon as its batch is predicted, so only the accumulators of the images in flight are held.
+    Yields the uint8 (height, width, 1) mask of every image, in order.
+    """
+    tile_height, tile_width = tile_shape
+    weights = get_tile_weights(tile_shape)[..., np.newaxis]
+    in_flight = deque()
+    tiles = []
+    owners = []
+
+    def predict_batch():
+        logits = np.asarray(predict_logits(np.stack(tiles)))
+        for tile_logits, (record, y, x) in zip(logits, owners):
+            if record['accumulator'] is None:
+                record['accumulator'] = np.zeros(record['shape'] + (tile_logits.shape[-1],), dtype=np.float32)
+            record['accumulator'][y:y + tile_height, x:x + tile_width] += tile_logits * weights
+            record['remaining'] -= 1
+        tiles.clear()
+        owners.clear()
+
+    def completed_masks():
+        while in_flight and in_flight[0]['remaining'] == 0:
+            record = in_flight.popleft()
+            # The weights are positive, so the argmax of the weighted sum is the argmax of the weighted mean
+            mask = np.argmax(record['accumulator'], axis=-1).astype(np.uint8)
+            yield mask[:record['height'], :record['width'], np.newaxis]
+
+    for image in images:
+        image = np.asarray(image, dtype=np.float32)
+        height, width = image.shape[:2]
+        pad = ((0, max(tile_height - height, 0)), (0, max(tile_width - width, 0)), (0, 0))
+        image = np.pad(image, pad, mode='edge')
+        positions = [(y, x) for y in get_tile_positions(image.shape[0], tile_height, overlap)
+                     for x in get_tile_positions(image.shape[1], tile_width, overlap)]
+        record = {'shape': image.shape[:2], 'height': height, 'width': width, 'accumulator': None,
+                  'remaining': len(positions)}
+        in_flight.append(record)
+        for y, x in positions:
+            tiles.append(image[y:y + tile_height, x:x + tile_width])
+            owners.append((record, y, x))
+            if len(tiles) == batch_size:
+                predict_batch()
+                yield from completed_masks()
+    if tiles:
+        predict_batch()
+    yield from completed_masks()
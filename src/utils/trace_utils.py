@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import tensorflow as tf
+
+from collections import OrderedDict
+
+from utils.values_utils import TRACE_PATH
+
+
+def get_block_name(layer_name):
+    return layer_name.rsplit('_', 1)[0]
+
+
+class BlockTracer:
+    """
+    Opt-in shape and timing trace of the blocks of UNetSTD, UNetTCED and ResUNet.
+    Wraps the call of every layer of the model from the outside, so the forward passes stay free of debug code.
+    Latencies are only meaningful when the model runs eagerly.
+    """
+
+    def __init__(self, model, synchronize=True):
+        self.model = model
+        self.synchronize = synchronize
+        self.records = []
+        self.original_calls = {}
+
+    def attach(self):
+        for name, layer in list(vars(self.model).items()):
+            if isinstance(layer, tf.keras.layers.Layer) and not isinstance(layer, tf.keras.Model):
+                # None when the layer uses the call of its class, which detach restores by deleting the override
+                self.original_calls[name] = vars(layer).get('call')
+                layer.call = self.traced_call(name, layer.call)
+
+        return self
+
+    def detach(self):
+        for name, call in self.original_calls.items():
+            layer = getattr(self.model, name)
+            if call is None:
+                del layer.call
+            else:
+                layer.call = call
+        self.original_calls = {}
+
+    def traced_call(self, name, call):
+        def call_and_record(*args, **kwargs):
+            start = time.perf_counter()
+            outputs = call(*args, **kwargs)
+            if self.synchronize and tf.executing_eagerly():
+                outputs.numpy()
+            self.records.append({'layer': name,
+                                 'block': get_block_name(name),
+                                 'shape': outputs.shape.as_list(),
+                                 'ms': (time.perf_counter() - start) * 1000.0})
+            return outputs
+
+        return call_and_record
+
+    def summary(self):
+        blocks = OrderedDict()
+        for record in self.records:
+            block = blocks.setdefault(record['block'], {'block': record['block'], 'calls': 0, 'ms': 0.0})
+            block['calls'] += 1
+            block['ms'] += record['ms']
+            block['shape'] = record['shape']
+
+        return list(blocks.values())
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+
+def trace_model(model, images, trace_path=TRACE_PATH):
+    with BlockTracer(model) as tracer:
+        model(images, training=False)
+
+    summary = tracer.summary()
+    os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+    with open(trace_path, 'w') as trace_file:
+        json.dump({'layers': tracer.records, 'blocks': summary}, trace_file, indent=2)
+
+    for block in summary:
+        print("{:<24} {:<24} {:>4} calls {:>10.3f} ms".format(block['block'], str(block['shape']), block['calls'],
+                                                             block['ms']))
+
+    return summary
@@ -8,24 +8,82 @@ VAL_SUB_SPLIT = 5
 BUFFER_SIZE = 500
 BATCH_SIZE = 32
 VAL_SPLIT = 0.2
+STRATEGY = 'default'
+SHUFFLE_SEED = 40
+ACCUMULATION_STEPS = 1
+SAMPLING_MODE = None
+SAMPLING_MODES = ('balanced', 'hard')
+SAMPLING_POWER = 0.5
+MAX_SAMPLE_WEIGHT = 10.0
+HARD_EXAMPLE_FRACTION = 0.25
+HARD_EXAMPLE_MOMENTUM = 0.7
+AUGMENT = False
+FLIP_PROBABILITY = 0.5
+MIN_CROP_SCALE = 0.75
+BRIGHTNESS_DELTA = 0.1
+CONTRAST_RANGE = (0.8, 1.2)
+NUM_THREADS = None  # None lets tf.data autotune the host threads, an int caps them
 
 # Model Inputs
 FILTERS = 32
 CLASSES = 23
-INPUT_SIZE = ([32, 96, 128, 3])
+INPUT_SIZE = ([None, None, None, 3])  # fully convolutional, any height and width divisible by SIZE_MULTIPLE
+SIZE_MULTIPLE = 16
+PRECISION = 'float32'  # 'float32', 'mixed_float16' or 'mixed_bfloat16'
+MODEL_VARIANT = 'UNetSTD'  # 'UNetSTD', 'UNetTCED' or 'ResUNet'
 INF_INPUT_SIZE = (1, 96, 128, 3)
+IMAGE_SHAPE = (96, 128)
+
+# Inference Inputs
+WRITER_THREADS = 4
+MAX_PENDING_BATCHES = 2
+INFERENCE_BACKEND = 'keras'  # 'keras' or 'tflite' for the INT8 quantized model
+INFERENCE_THREADS = None
+NUM_CALIBRATION_SAMPLES = 100
+VIDEO_BATCH_SIZE = 32
+VIDEO_QUEUE_SIZE = 4
+VIDEO_QUEUE_TIMEOUT = 0.5  # seconds between checks that the other stages are still running
+VIDEO_OUTPUT_MODE = 'overlay'  # 'mask' or 'overlay'
+SEEK_THRESHOLD = 48  # frame gaps above this are seeked over instead of grabbed
+SAMPLING_WORKERS = None
+REUSE_THRESHOLD = None  # mean absolute thumbnail difference in [0, 1] under which a frame reuses the previous mask
+KEYFRAME_INTERVAL = 5
+REUSE_STRIDE = 4
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8500
+BATCH_DEADLINE_MS = 10
+TILE_OVERLAP = 32
 
 # Callbacks Inputs
-CURR_DATETIME = str(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+CURR_DATETIME = str(datetime.datetime.now().strftime(TIMESTAMP_FORMAT))
 MODEL_DIR = "./saved_model/"
 MODEL_EXTENSION = '.hdf5'
+REGISTRY_PATH = MODEL_DIR + "index.json"
+CHECKPOINT_SELECTIONS = ('latest', 'best')
+MODEL_CACHE_SIZE = 4
+MONITOR = 'val_mean_iou'
+MONITOR_MODE = 'max'
+EXPORT_DIR = "./exported_model/"
+TFLITE_PATH = EXPORT_DIR + "model_int8.tflite"
+QUANTIZATION_REPORT_PATH = EXPORT_DIR + "quantization_report.json"
 #MODEL_FILEPATH = MODEL_DIR + CURR_DATETIME + '.epoch{epoch:02d}-loss{val_loss:.2f}.hdf5'
 #MODEL_FILEPATH = MODEL_DIR + CURR_DATETIME + MODEL_EXTENSION
 TENSORBOARD_LOG_DIR = "./tensorboard_logs_dir/logs"+CURR_DATETIME
 LOGGER_DIR = "./csv_logger_dir/training"+CURR_DATETIME+".log"
+TRACE_PATH = "./trace_logs/trace"+CURR_DATETIME+".json"
+EVALUATION_REPORT_PATH = "./evaluation_logs/evaluation"+CURR_DATETIME+".json"
+PROFILE_STEPS = None
+BLOCK_SAMPLES = 3
 SAVE_WEIGHTS_ONLY = True
 SAVE_BEST_ONLY = True
 
 # Data Inputs
 IMAGES_SRC = "./data/carla/images"
 MASKS_SRC = "./data/carla/masks"
+# 'decode' reads the PNGs on every run, 'shards' streams the preprocessed shard cache,
+# 'mmap' reads batches from a shared memory-mapped uint8 store
+DATA_BACKEND = 'decode'
+CACHE_DIR = "./data/cache/"
+MANIFEST_WORKERS = None
+NUM_SHARDS = 8
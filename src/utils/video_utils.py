@@ -1,41 +1,72 @@
 import math
+import queue
+import threading
+import time
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
 from cv2 import cv2
 
+from utils.values_utils import IMAGE_SHAPE, CLASSES, VIDEO_BATCH_SIZE, VIDEO_QUEUE_SIZE, VIDEO_QUEUE_TIMEOUT, \
+    VIDEO_OUTPUT_MODE, SEEK_THRESHOLD, SAMPLING_WORKERS
 
-def get_num_frames_from_videos(path, num_extraction):
-    required_frames_per_sec = 10
-    cap = cv2.VideoCapture(path)  # capturing the video from the given path
-    frame_rate = cap.get(5)  # frame rate
-    if frame_rate not in range(1, 50):  # make it more logical
-        frame_rate = 25
+END_OF_STREAM = None
+
+
+def get_sampled_frame_indices(num_frame, frame_rate, num_extraction, required_frames_per_sec=10):
     rate_divisor = max(math.ceil(frame_rate / required_frames_per_sec), 1)
-    num_frame = cap.get(7)
     video_duration = round(float(num_frame) / float(frame_rate), 2)
     second_divisor = max(math.floor(video_duration / num_extraction), 1)
-    total_created_frame = 0
+
+    return [frame_id for frame_id in range(int(num_frame))
+            if int(frame_id / frame_rate) % second_divisor == 0 and frame_id % rate_divisor == 0]
+
+
+def read_frames_at(cap, frame_indices, seek_threshold=SEEK_THRESHOLD, size=(224, 224)):
+    """
+    Decodes only the requested frames: short gaps are skipped with grab(), which demuxes without decoding into an
+    image, and gaps longer than seek_threshold frames are jumped over by seeking.
+    """
     frames = []
-    while cap.isOpened():
-        frame_id = cap.get(1)
+    position = 0
+    for frame_id in frame_indices:
+        if frame_id - position > seek_threshold:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+            position = frame_id
+        while position < frame_id:
+            if not cap.grab():
+                return frames
+            position += 1
         ret, frame = cap.read()
-        current_second = int(frame_id / frame_rate)
-        if current_second % second_divisor == 0:
-            if not ret:
-                break
-            if frame_id % rate_divisor == 0:
-                total_created_frame += 1
-                frame = cv2.resize(frame, (224, 224))
-                frames.append(frame)
-        else:
-            if not ret:
-                break
+        if not ret:
+            break
+        position += 1
+        frames.append(cv2.resize(frame, size))
+
+    return frames
 
+
+def get_num_frames_from_videos(path, num_extraction):
+    cap = cv2.VideoCapture(path)  # capturing the video from the given path
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    if not 1 <= frame_rate < 50:
+        frame_rate = 25
+    num_frame = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    frame_indices = get_sampled_frame_indices(num_frame, frame_rate, num_extraction)
+    frames = read_frames_at(cap, frame_indices)
     cap.release()
     frames_array = np.asarray(frames)
     return frames_array
 
 
+def get_num_frames_from_many_videos(paths, num_extraction, workers=SAMPLING_WORKERS):
+    """
+    Samples several videos in parallel worker processes, returning the frames of each video in the order of paths.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(get_num_frames_from_videos, paths, [num_extraction] * len(paths)))
+
+
 def get_all_frames_from_videos(path):
     cap = cv2.VideoCapture(path)  # capturing the video from the given path
     total_created_frame = 0
@@ -50,3 +81,141 @@ def get_all_frames_from_videos(path):
     cap.release()
     frames_array = np.asarray(frames)
     return frames_array
+
+
+def get_class_palette(classes=CLASSES):
+    return np.random.RandomState(0).randint(0, 256, size=(classes, 3)).astype(np.uint8)
+
+
+def put_unless_stopped(item_queue, item, stop, timeout=VIDEO_QUEUE_TIMEOUT):
+    """
+    Puts item in the bounded queue, giving up once stop is set. Returns whether the item was put.
+    """
+    while not stop.is_set():
+        try:
+            item_queue.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_unless_stopped(item_queue, stop, timeout=VIDEO_QUEUE_TIMEOUT):
+    """
+    Next item of the queue, END_OF_STREAM once stop is set.
+    """
+    while not stop.is_set():
+        try:
+            return item_queue.get(timeout=timeout)
+        except queue.Empty:
+            continue
+    return END_OF_STREAM
+
+
+def run_stage(stage, errors, stop, *args):
+    # An error of a stage stops the other ones, segment_video raises it once they are joined
+    try:
+        stage(*args, stop=stop)
+    except Exception as error:
+        errors.append(error)
+        stop.set()
+
+
+def produce_frame_batches(path, frame_queue, batch_size=VIDEO_BATCH_SIZE, shape=IMAGE_SHAPE, stop=None):
+    """
+    Decodes the video frame by frame, resizing every frame straight to the model input and putting RGB uint8
+    batches in the bounded queue, which blocks the decoding when the model falls behind. Returns early once stop is
+    set.
+    """
+    stop = threading.Event() if stop is None else stop
+    cap = cv2.VideoCapture(path)
+    batch = []
+    try:
+        while cap.isOpened() and not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+            batch.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if len(batch) == batch_size:
+                put_unless_stopped(frame_queue, np.stack(batch), stop)
+                batch = []
+        if batch:
+            put_unless_stopped(frame_queue, np.stack(batch), stop)
+    finally:
+        cap.release()
+        put_unless_stopped(frame_queue, END_OF_STREAM, stop)
+
+
+def consume_mask_batches(mask_queue, writer, mode=VIDEO_OUTPUT_MODE, palette=None, stop=None):
+    stop = threading.Event() if stop is None else stop
+    palette = get_class_palette() if palette is None else palette
+    while True:
+        item = get_unless_stopped(mask_queue, stop)
+        if item is END_OF_STREAM:
+            break
+        frames, masks = item
+        output_frames = palette[masks[..., 0]]
+        if mode == 'overlay':
+            output_frames = (frames.astype(np.uint16) + output_frames) // 2
+        for output_frame in output_frames.astype(np.uint8):
+            writer.write(cv2.cvtColor(output_frame, cv2.COLOR_RGB2BGR))
+
+
+def segment_video(predict_mask, source_path, destination_path, mode=VIDEO_OUTPUT_MODE, batch_size=VIDEO_BATCH_SIZE,
+                  queue_size=VIDEO_QUEUE_SIZE, shape=IMAGE_SHAPE):
+    """
+    Segments a video of any length with constant memory: a producer thread decodes and batches the frames, the
+    calling thread runs predict_mask on each batch and a consumer thread writes the mask (or overlay) video.
+    At most queue_size batches wait between two stages. An error in any stage stops the other two and is raised.
+    """
+    cap = cv2.VideoCapture(source_path)
+    frame_rate = cap.get(cv2.CAP_PROP_FPS) or 25
+    cap.release()
+
+    writer = cv2.VideoWriter(destination_path, cv2.VideoWriter_fourcc(*'mp4v'), frame_rate, (shape[1], shape[0]))
+    frame_queue = queue.Queue(maxsize=queue_size)
+    mask_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    producer = threading.Thread(target=run_stage,
+                                args=(produce_frame_batches, errors, stop, source_path, frame_queue, batch_size, shape),
+                                daemon=True)
+    consumer = threading.Thread(target=run_stage, args=(consume_mask_batches, errors, stop, mask_queue, writer, mode),
+                                daemon=True)
+
+    start = time.perf_counter()
+    producer.start()
+    consumer.start()
+    count = 0
+    try:
+        while True:
+            frames = get_unless_stopped(frame_queue, stop)
+            if frames is END_OF_STREAM:
+                break
+            masks = np.asarray(predict_mask(frames.astype(np.float32) / 255.0))
+            if not put_unless_stopped(mask_queue, (frames, masks), stop):
+                break
+            count += len(frames)
+        put_unless_stopped(mask_queue, END_OF_STREAM, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        consumer.join()
+        writer.release()
+        # Releases a producer still decoding, e.g. after an error of the consumer
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
+    seconds = time.perf_counter() - start
+
+    stats = {'frames': count, 'seconds': seconds, 'fps': count / seconds if seconds > 0 else 0.0}
+    print("Segmented {} frames in {:.2f} s, {:.2f} frames per second".format(count, seconds, stats['fps']))
+    if hasattr(predict_mask, 'stats'):
+        reuse_stats = predict_mask.stats()
+        stats.update(reuse_stats)
+        print("Temporal reuse", reuse_stats)
+
+    return stats